@@ -0,0 +1,319 @@
+"""End-to-end latency benchmark per output type.
+
+Runs the same path as a chat turn in the UI: history_to_messages ->
+chat_with_model -> process_code_output -> history_to_chatbot_messages. Each
+output type gets a series of requests, sent one at a time so timings don't
+include queueing. Reported: time to first token, decode tokens/s, total
+latency percentiles and the share of time spent in Python-side parsing and
+history conversion. Results are written to a JSON file. Pass an earlier
+file as --baseline to print the change between versions.
+
+    python benchmarks/e2e_benchmark.py                       # in-process mock Ollama
+    python benchmarks/e2e_benchmark.py --ollama http://localhost:11434 --model qwen2.5-coder:7b
+"""
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from typing import Dict, List, Optional
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from mock_ollama import MockOllama, canned_response  # noqa: E402
+
+DEFAULT_OUTPUT_TYPES = ["HTML", "Transformers.js", "Svelte", "Python"]
+PROMPTS = [
+    "Create a landing page for a coffee shop with a menu section",
+    "Build a todo list with add, remove and filter buttons",
+    "Make a pricing table with three tiers and a monthly/yearly toggle",
+    "Create a weather dashboard with a five day forecast",
+]
+
+
+def percentiles(values: List[float]) -> Dict[str, float]:
+    """Mean and nearest-rank p50/p90/p99 of ``values``."""
+    if not values:
+        return {}
+    ordered = sorted(values)
+
+    def rank(q):
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    return {
+        "mean": round(sum(ordered) / len(ordered), 3),
+        "p50": round(rank(0.5), 3),
+        "p90": round(rank(0.9), 3),
+        "p99": round(rank(0.99), 3),
+    }
+
+
+class Timer:
+    """Wraps a function and adds up the time spent in it."""
+
+    def __init__(self, fn):
+        self.fn = fn
+        self.seconds = 0.0
+
+    def __call__(self, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return self.fn(*args, **kwargs)
+        finally:
+            self.seconds += time.perf_counter() - start
+
+
+def make_history(main, output_type: str, turns: int) -> List[List[str]]:
+    """``turns`` earlier exchanges with realistic code responses."""
+    system = main.get_system_prompt(output_type, False)
+    history = []
+    for i in range(turns):
+        prompt = PROMPTS[i % len(PROMPTS)]
+        messages = [
+            {"role": "system", "content": system},
+            {"role": "user", "content": prompt},
+        ]
+        history.append([prompt, canned_response(messages, 400)])
+    return history
+
+
+def run_request(main, timers, model: str, output_type: str, prompt: str, history):
+    """One chat turn; returns the timings of the request."""
+    system = main.get_system_prompt(output_type, False)
+    stats_before = main.GENERATION_STATS[-1] if main.GENERATION_STATS else None
+    for timer in timers.values():
+        timer.seconds = 0.0
+
+    start = time.perf_counter()
+    first_token = None
+    response = ""
+    for response, new_history in main.stream_chat_with_model(
+        prompt,
+        [list(turn) for turn in history],
+        model,
+        0.7,
+        system,
+        False,
+        output_type=output_type,
+    ):
+        if response and first_token is None:
+            first_token = time.perf_counter()
+    generated = time.perf_counter()
+    code = timers["process_code_output"](response, output_type)
+    timers["history_to_chatbot_messages"](new_history)
+    end = time.perf_counter()
+
+    if response.startswith("Error:") or first_token is None:
+        return {"error": response or "empty response"}
+
+    # Prefer Ollama's own decode timing; early-stopped streams only have an
+    # estimate, which the timing measured here replaces
+    stats = main.GENERATION_STATS[-1] if main.GENERATION_STATS else None
+    if (
+        stats is not None
+        and stats is not stats_before
+        and not stats["estimated"]
+        and stats["eval_ms"] > 0
+    ):
+        tokens = stats["eval_count"]
+        decode_tps = tokens / (stats["eval_ms"] / 1000)
+    else:
+        tokens = main.TOKEN_ESTIMATOR.count(model, response)
+        decode_seconds = generated - first_token
+        decode_tps = tokens / decode_seconds if decode_seconds > 0 else 0.0
+
+    python_seconds = sum(timer.seconds for timer in timers.values())
+    total = end - start
+    return {
+        "ttft_ms": (first_token - start) * 1000,
+        "total_ms": total * 1000,
+        "decode_tps": decode_tps,
+        "output_tokens": tokens,
+        "python_ms": python_seconds * 1000,
+        "python_share": python_seconds / total if total > 0 else 0.0,
+        "parse_ms": timers["process_code_output"].seconds * 1000,
+        "history_ms": (
+            timers["history_to_messages"].seconds
+            + timers["history_to_chatbot_messages"].seconds
+        )
+        * 1000,
+        "code_chars": len(code),
+    }
+
+
+def summarize(samples: List[Dict]) -> Dict:
+    ok = [s for s in samples if "error" not in s]
+    summary = {"requests": len(samples), "errors": len(samples) - len(ok)}
+    for key in (
+        "ttft_ms",
+        "total_ms",
+        "decode_tps",
+        "output_tokens",
+        "python_ms",
+        "parse_ms",
+        "history_ms",
+    ):
+        summary[key] = percentiles([s[key] for s in ok])
+    if ok:
+        summary["python_share"] = round(
+            sum(s["python_ms"] for s in ok) / sum(s["total_ms"] for s in ok), 5
+        )
+    errors = sorted({s["error"] for s in samples if "error" in s})
+    if errors:
+        summary["error_messages"] = errors[:5]
+    return summary
+
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=ROOT,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_report(results: Dict, baseline: Optional[Dict]):
+    print(
+        f"\n{'output type':<18}{'ttft p50':>10}{'total p50':>11}{'total p90':>11}"
+        f"{'total p99':>11}{'tok/s':>8}{'python':>9}"
+    )
+    for output_type, summary in results.items():
+        if not summary.get("total_ms"):
+            print(f"{output_type:<18}  all {summary['requests']} requests failed")
+            continue
+        print(
+            f"{output_type:<18}{summary['ttft_ms']['p50']:>8.0f}ms"
+            f"{summary['total_ms']['p50']:>9.0f}ms{summary['total_ms']['p90']:>9.0f}ms"
+            f"{summary['total_ms']['p99']:>9.0f}ms{summary['decode_tps']['mean']:>8.1f}"
+            f"{summary['python_share'] * 100:>8.2f}%"
+        )
+        old = (baseline or {}).get("results", {}).get(output_type)
+        if old and old.get("total_ms"):
+            changes = []
+            for key in ("ttft_ms", "total_ms", "python_ms"):
+                before, after = old[key]["p50"], summary[key]["p50"]
+                if before:
+                    changes.append(f"{key} p50 {(after - before) / before * 100:+.1f}%")
+            print(f"{'':<18}vs baseline: {', '.join(changes)}")
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--ollama", help="Ollama URL to benchmark (default: start a mock in-process)"
+    )
+    parser.add_argument("--model", help="model to use (default: the app's default)")
+    parser.add_argument(
+        "--output-types",
+        default=",".join(DEFAULT_OUTPUT_TYPES),
+        help="comma-separated output types",
+    )
+    parser.add_argument("--requests", type=int, default=20, help="per output type")
+    parser.add_argument("--warmup", type=int, default=1, help="untimed requests first")
+    parser.add_argument(
+        "--history-turns",
+        type=int,
+        default=3,
+        help="earlier turns sent with each request",
+    )
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--baseline", help="earlier results file to compare against")
+    mock_group = parser.add_argument_group("mock Ollama")
+    mock_group.add_argument("--mock-ttft", type=float, default=0.05)
+    mock_group.add_argument("--mock-tokens-per-second", type=float, default=400.0)
+    mock_group.add_argument("--mock-response-tokens", type=int, default=300)
+    args = parser.parse_args()
+
+    mock = None
+    if not args.ollama:
+        mock = MockOllama(
+            ttft=args.mock_ttft,
+            tokens_per_second=args.mock_tokens_per_second,
+            response_tokens=args.mock_response_tokens,
+        )
+        args.ollama = mock.start()
+        print(f"🧪 Mock Ollama at {args.ollama}")
+
+    # main reads its configuration at import time. Cached responses would
+    # skip the model, so caching is off unless set explicitly
+    os.environ["OLLAMA_BASE_URL"] = args.ollama
+    os.environ.setdefault("RESPONSE_CACHE", "0")
+    os.environ.setdefault("SEMANTIC_CACHE", "0")
+    os.environ.setdefault("LOG_GENERATION_STATS", "0")
+    import main
+
+    model = args.model or main.DEFAULT_MODEL_ID
+    if not model:
+        sys.exit("No model available; pass --model")
+
+    timers = {
+        name: Timer(getattr(main, name))
+        for name in (
+            "history_to_messages",
+            "process_code_output",
+            "history_to_chatbot_messages",
+        )
+    }
+    # The generation core looks history_to_messages up in main at call time
+    main.history_to_messages = timers["history_to_messages"]
+
+    results = {}
+    try:
+        for output_type in [t.strip() for t in args.output_types.split(",") if t]:
+            history = make_history(main, output_type, args.history_turns)
+            samples = []
+            for i in range(args.warmup + args.requests):
+                prompt = PROMPTS[i % len(PROMPTS)]
+                sample = run_request(main, timers, model, output_type, prompt, history)
+                if i >= args.warmup:
+                    samples.append(sample)
+            results[output_type] = summarize(samples)
+            print(f"✅ {output_type}: {len(samples)} requests")
+    finally:
+        main.history_to_messages = timers["history_to_messages"].fn
+        if mock is not None:
+            mock.stop()
+
+    report = {
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "ollama": "mock" if mock is not None else args.ollama,
+        "model": model,
+        "settings": {
+            "requests": args.requests,
+            "warmup": args.warmup,
+            "history_turns": args.history_turns,
+            "early_stop": main.EARLY_STOP_ENABLED,
+        },
+        "results": results,
+    }
+    if mock is not None:
+        report["settings"]["mock"] = {
+            "ttft": args.mock_ttft,
+            "tokens_per_second": args.mock_tokens_per_second,
+            "response_tokens": args.mock_response_tokens,
+        }
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+    print_report(results, baseline)
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nResults written to {args.output}")
+
+
+if __name__ == "__main__":
+    main_cli()
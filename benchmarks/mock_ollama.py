@@ -0,0 +1,579 @@
+"""Stand-in Ollama server for offline tests and benchmarks.
+
+Implements the parts of the Ollama HTTP API this repo uses: /api/tags,
+/api/ps, /api/show, /api/chat and /api/generate (streaming and not),
+/api/embed and /api/embeddings. Timing is configurable: model load time,
+time to first token, prompt and decode speed. Responses are canned per
+output type (detected from the system prompt), fixed, or scripted by regex.
+Errors and dropped connections can be injected at random.
+
+    python benchmarks/mock_ollama.py --port 11435 --ttft 0.2 --tokens-per-second 40
+    OLLAMA_BASE_URL=http://127.0.0.1:11435 python main.py
+
+It can also run in-process:
+
+    server = MockOllama(models=["qwen2.5-coder:7b"], tokens_per_second=200)
+    base_url = server.start()
+    ...
+    server.stop()
+
+Only the standard library is used.
+"""
+
+import argparse
+import hashlib
+import json
+import math
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+
+DEFAULT_MODELS = ["qwen2.5-coder:7b", "llama3.2:3b", "nomic-embed-text:latest"]
+
+# Streamed chunks are about one token each: up to 4 characters plus leading space
+_TOKEN = re.compile(r"\s*\S{1,4}|\s+")
+
+_FILLER_HTML = (
+    '      <div class="card"><h2>Feature</h2><p>Fast, local and private.</p></div>\n'
+)
+_FILLER_CODE = "    total = sum(value * 2 for value in values)  # keep going\n"
+
+
+def split_tokens(text: str) -> List[str]:
+    """Split ``text`` into token-sized chunks that join back to ``text``."""
+    return _TOKEN.findall(text)
+
+
+def _padding(line: str, tokens: int) -> str:
+    """Repeat ``line`` until it adds roughly ``tokens`` tokens."""
+    per_line = max(1, len(split_tokens(line)))
+    return line * max(0, tokens // per_line)
+
+
+def canned_response(messages: List[Dict], response_tokens: int) -> str:
+    """A plausible response for the output type the system prompt asks for,
+    padded to about ``response_tokens`` tokens. Like real models, a short
+    explanation follows the code."""
+    system = (
+        messages[0].get("content", "")
+        if messages and messages[0]["role"] == "system"
+        else ""
+    )
+    outro = "\n\nThis code creates the requested page with a clean, responsive layout."
+    html_fill = _padding(_FILLER_HTML, response_tokens)
+    code_fill = _padding(_FILLER_CODE, response_tokens)
+
+    if "SEARCH/REPLACE" in system:
+        return (
+            "Updating the page.\n<<<<<<< SEARCH\n</body>\n=======\n"
+            "  <footer>Edited</footer>\n</body>\n>>>>>>> REPLACE\n"
+        )
+    if "transformers.js" in system.lower():
+        third = response_tokens // 3
+        markup = _padding(_FILLER_HTML, third)
+        script = _padding('console.log(await classifier("great"));\n', third)
+        styles = _padding(".card { margin: 1rem; padding: 1rem; }\n", third)
+        return (
+            '```html\n<!DOCTYPE html>\n<html>\n<head><link rel="stylesheet" '
+            f'href="style.css"></head>\n<body>\n{markup}<script type="module" '
+            'src="index.js"></script>\n</body>\n</html>\n```\n\n'
+            "```javascript\nimport { pipeline } from "
+            "'https://cdn.jsdelivr.net/npm/@huggingface/transformers';\n"
+            f"const classifier = await pipeline('sentiment-analysis');\n{script}"
+            f"```\n\n```css\nbody {{ font-family: sans-serif; }}\n{styles}```{outro}"
+        )
+    if "Svelte" in system:
+        markup = _padding(_FILLER_HTML, response_tokens // 2)
+        styles = _padding("main { display: grid; gap: 1rem; }\n", response_tokens // 2)
+        return (
+            '```svelte\n<script lang="ts">\n  let count = 0;\n</script>\n\n'
+            f"<main>\n{markup}  <button on:click={{() => count++}}>{{count}}</button>\n"
+            f"</main>\n```\n\n```css\n{styles}```{outro}"
+        )
+    if "multi-file project" in system:
+        return (
+            "=== app.py ===\n```python\nfrom flask import Flask, render_template\n\n"
+            'app = Flask(__name__)\n\n\n@app.route("/")\ndef index():\n'
+            '    return render_template("index.html")\n```\n\n'
+            "=== templates/index.html ===\n```html\n<!DOCTYPE html>\n<html>\n<body>\n"
+            f"{html_fill}</body>\n</html>\n```\n\n"
+            "=== static/style.css ===\n```css\nbody { margin: 0; }\n```\n\n"
+            "=== requirements.txt ===\n```\nflask\n```"
+        )
+    language = re.search(r"runnable (\S+) code", system)
+    if language:
+        return (
+            f"```{language.group(1)}\ndef main(values):\n{code_fill}"
+            f"    return total\n```{outro}"
+        )
+    if system:
+        return (
+            '```html\n<!DOCTYPE html>\n<html lang="en">\n<head>\n  <meta charset="UTF-8">\n'
+            "  <title>Mock Page</title>\n</head>\n<body>\n  <main>\n"
+            f"{html_fill}  </main>\n</body>\n</html>\n```{outro}"
+        )
+    return "Based on the provided context, " + _padding(
+        "the answer follows from the documents. ", response_tokens
+    )
+
+
+def embed_text(text: str, dimensions: int) -> List[float]:
+    """Deterministic unit vector from hashed words, so texts sharing words
+    are similar."""
+    vector = [0.0] * dimensions
+    for word in re.findall(r"\w+", text.lower()):
+        digest = hashlib.sha256(word.encode("utf-8")).digest()
+        index = int.from_bytes(digest[:4], "little") % dimensions
+        vector[index] += 1.0 if digest[4] % 2 else -1.0
+    norm = math.sqrt(sum(v * v for v in vector)) or 1.0
+    return [v / norm for v in vector]
+
+
+class MockOllama:
+    """Mock Ollama server running in a background thread.
+
+    ``ttft`` is the delay before the first token on top of prompt evaluation
+    (``prompt_tokens_per_second``, 0 = instant) and model loading
+    (``load_time``, paid once per model until it is unloaded with
+    keep_alive=0). ``num_parallel`` requests are served at once and the rest
+    wait, as in Ollama. ``script`` is a list of {"match": regex, "response":
+    text} rules (optionally with "ttft", "tokens_per_second" or "error")
+    tried in order against the last user message. Every POST is logged as
+    (path, body) in ``requests``.
+    """
+
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        models: Optional[List[str]] = None,
+        context_length: int = 8192,
+        ttft: float = 0.05,
+        tokens_per_second: float = 100.0,
+        prompt_tokens_per_second: float = 0.0,
+        load_time: float = 0.0,
+        response_tokens: int = 200,
+        response: Optional[str] = None,
+        script: Optional[List[Dict]] = None,
+        error_rate: float = 0.0,
+        disconnect_rate: float = 0.0,
+        num_parallel: int = 4,
+        embedding_dimensions: int = 64,
+        seed: Optional[int] = None,
+        verbose: bool = False,
+    ):
+        self.models = list(models or DEFAULT_MODELS)
+        self.context_length = context_length
+        self.ttft = ttft
+        self.tokens_per_second = tokens_per_second
+        self.prompt_tokens_per_second = prompt_tokens_per_second
+        self.load_time = load_time
+        self.response_tokens = response_tokens
+        self.response = response
+        self.script = [
+            dict(rule, match=re.compile(rule["match"])) for rule in script or []
+        ]
+        self.error_rate = error_rate
+        self.disconnect_rate = disconnect_rate
+        self.embedding_dimensions = embedding_dimensions
+        self.verbose = verbose
+        self.resident = set()
+        self.stats = {"requests": 0, "errors": 0, "disconnects": 0, "cancelled": 0}
+        self.requests: List[Tuple[str, Dict]] = []
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max(1, num_parallel))
+        self._server = ThreadingHTTPServer((host, port), _Handler)
+        self._server.daemon_threads = True
+        self._server.mock = self
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> str:
+        """Serve in a daemon thread and return the base URL."""
+        self._thread = threading.Thread(
+            target=self._server.serve_forever, name="mock-ollama", daemon=True
+        )
+        self._thread.start()
+        return self.base_url
+
+    def serve_forever(self):
+        self._server.serve_forever()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def digest(self, model: str) -> str:
+        return hashlib.sha256(model.encode("utf-8")).hexdigest()
+
+    def roll(self, rate: float) -> bool:
+        with self._lock:
+            return rate > 0 and self._random.random() < rate
+
+    def count(self, key: str):
+        with self._lock:
+            self.stats[key] += 1
+
+    def plan(self, model: str, messages: List[Dict], options: Dict) -> Dict:
+        """Decide the response text and timing for one generation request."""
+        last_user = next(
+            (
+                m.get("content", "")
+                for m in reversed(messages)
+                if m.get("role") == "user"
+            ),
+            "",
+        )
+        rule = next((r for r in self.script if r["match"].search(last_user)), {})
+        text = rule.get("response") or self.response
+        if text is None:
+            text = canned_response(messages, self.response_tokens)
+
+        done_reason = "stop"
+        for stop in options.get("stop") or []:
+            if stop and stop in text:
+                text = text[: text.index(stop)]
+        tokens = split_tokens(text)
+        limit = options.get("num_predict")
+        if limit is not None and 0 <= limit < len(tokens):
+            tokens, done_reason = tokens[:limit], "length"
+
+        prompt_tokens = max(
+            1, sum(len(str(m.get("content", ""))) for m in messages) // 4
+        )
+        delay = rule.get("ttft", self.ttft)
+        if self.prompt_tokens_per_second > 0:
+            delay += prompt_tokens / self.prompt_tokens_per_second
+        load = 0.0
+        with self._lock:
+            if model not in self.resident:
+                load = self.load_time
+                self.resident.add(model)
+        return {
+            "error": rule.get("error"),
+            "tokens": tokens,
+            "ttft": delay + load,
+            "load": load,
+            "tokens_per_second": rule.get("tokens_per_second", self.tokens_per_second),
+            "prompt_tokens": prompt_tokens,
+            "done_reason": done_reason,
+        }
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_version = "MockOllama/1.0"
+    # Small streamed chunks must not wait for delayed ACKs
+    disable_nagle_algorithm = True
+
+    @property
+    def mock(self) -> MockOllama:
+        return self.server.mock
+
+    def log_message(self, format, *args):
+        if self.mock.verbose:
+            super().log_message(format, *args)
+
+    def _send_json(self, payload, status: int = 200):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_json(self) -> Dict:
+        length = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def do_GET(self):
+        if self.path == "/":
+            body = b"Ollama is running"
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        elif self.path == "/api/version":
+            self._send_json({"version": "0.0.0-mock"})
+        elif self.path == "/api/tags":
+            self._send_json(
+                {"models": [self._model_entry(m) for m in self.mock.models]}
+            )
+        elif self.path == "/api/ps":
+            with self.mock._lock:
+                resident = sorted(self.mock.resident)
+            self._send_json({"models": [self._model_entry(m) for m in resident]})
+        else:
+            self._send_json({"error": "not found"}, 404)
+
+    def do_POST(self):
+        request = self._read_json()
+        with self.mock._lock:
+            self.mock.requests.append((self.path, request))
+        routes = {
+            "/api/chat": self._generate,
+            "/api/generate": self._generate,
+            "/api/show": self._show,
+            "/api/embed": self._embed,
+            "/api/embeddings": self._embed,
+        }
+        handler = routes.get(self.path)
+        if handler is None:
+            self._send_json({"error": "not found"}, 404)
+            return
+        model = request.get("model") or request.get("name")
+        if model not in self.mock.models:
+            self._send_json({"error": f"model '{model}' not found"}, 404)
+            return
+        handler(model, request)
+
+    def _model_entry(self, model: str) -> Dict:
+        return {
+            "name": model,
+            "model": model,
+            "digest": self.mock.digest(model),
+            "size": 4_000_000_000,
+            "details": {"format": "gguf", "family": model.split(":")[0]},
+        }
+
+    def _show(self, model: str, request: Dict):
+        self._send_json(
+            {
+                "digest": self.mock.digest(model),
+                "details": {"format": "gguf", "family": model.split(":")[0]},
+                "model_info": {"general.context_length": self.mock.context_length},
+            }
+        )
+
+    def _embed(self, model: str, request: Dict):
+        dimensions = self.mock.embedding_dimensions
+        if self.path == "/api/embeddings":
+            self._send_json(
+                {"embedding": embed_text(request.get("prompt", ""), dimensions)}
+            )
+            return
+        inputs = request.get("input", "")
+        inputs = [inputs] if isinstance(inputs, str) else inputs
+        self._send_json(
+            {"model": model, "embeddings": [embed_text(t, dimensions) for t in inputs]}
+        )
+
+    def _generate(self, model: str, request: Dict):
+        mock = self.mock
+        mock.count("requests")
+        is_chat = self.path == "/api/chat"
+        if is_chat:
+            messages = request.get("messages") or []
+        else:
+            messages = []
+            if request.get("system"):
+                messages.append({"role": "system", "content": request["system"]})
+            messages.append({"role": "user", "content": request.get("prompt", "")})
+            if not request.get("prompt"):
+                # Warm-up / unload request: no generation
+                self._finish_load(model, request)
+                return
+
+        if mock.roll(mock.error_rate):
+            mock.count("errors")
+            self._send_json({"error": "mock failure (injected)"}, 500)
+            return
+
+        with mock._slots:
+            plan = mock.plan(model, messages, request.get("options") or {})
+            if plan["error"]:
+                mock.count("errors")
+                self._send_json({"error": plan["error"]}, 500)
+                return
+            started = time.perf_counter()
+            time.sleep(plan["ttft"])
+            if request.get("stream", True):
+                self._stream(model, plan, is_chat, started)
+            else:
+                tps = plan["tokens_per_second"]
+                if tps > 0:
+                    time.sleep(len(plan["tokens"]) / tps)
+                self._send_json(
+                    self._final(model, plan, "".join(plan["tokens"]), is_chat, started)
+                )
+        if request.get("keep_alive") in (0, "0", "0s"):
+            with mock._lock:
+                mock.resident.discard(model)
+
+    def _finish_load(self, model: str, request: Dict):
+        unload = request.get("keep_alive") in (0, "0", "0s")
+        with self.mock._lock:
+            loaded = model in self.mock.resident
+            if unload:
+                self.mock.resident.discard(model)
+            else:
+                self.mock.resident.add(model)
+        if not loaded and not unload:
+            time.sleep(self.mock.load_time)
+        self._send_json(
+            {
+                "model": model,
+                "response": "",
+                "done": True,
+                "done_reason": "unload" if unload else "load",
+            }
+        )
+
+    def _chunk(self, model: str, text: str, is_chat: bool) -> Dict:
+        chunk = {"model": model, "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ")}
+        if is_chat:
+            chunk["message"] = {"role": "assistant", "content": text}
+        else:
+            chunk["response"] = text
+        return chunk
+
+    def _final(self, model: str, plan: Dict, text: str, is_chat: bool, started: float):
+        elapsed = time.perf_counter() - started
+        decode = (
+            len(plan["tokens"]) / plan["tokens_per_second"]
+            if plan["tokens_per_second"] > 0
+            else 0.0
+        )
+        chunk = self._chunk(model, text, is_chat)
+        chunk.update(
+            {
+                "done": True,
+                "done_reason": plan["done_reason"],
+                "total_duration": int(elapsed * 1e9),
+                "load_duration": int(plan["load"] * 1e9),
+                "prompt_eval_count": plan["prompt_tokens"],
+                "prompt_eval_duration": int((plan["ttft"] - plan["load"]) * 1e9),
+                "eval_count": len(plan["tokens"]),
+                "eval_duration": int(decode * 1e9),
+            }
+        )
+        return chunk
+
+    def _write_chunk(self, payload: Dict):
+        line = json.dumps(payload).encode("utf-8") + b"\n"
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(line), line))
+        self.wfile.flush()
+
+    def _stream(self, model: str, plan: Dict, is_chat: bool, started: float):
+        mock = self.mock
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        tokens = plan["tokens"]
+        interval = 1 / plan["tokens_per_second"] if plan["tokens_per_second"] > 0 else 0
+        drop_at = (
+            mock._random.randrange(len(tokens))
+            if tokens and mock.roll(mock.disconnect_rate)
+            else None
+        )
+        try:
+            for index, token in enumerate(tokens):
+                if index == drop_at:
+                    mock.count("disconnects")
+                    self.close_connection = True
+                    return
+                if index and interval:
+                    time.sleep(interval)
+                self._write_chunk(self._chunk(model, token, is_chat))
+            self._write_chunk(self._final(model, plan, "", is_chat, started))
+            self.wfile.write(b"0\r\n\r\n")
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            # The client closed the stream, e.g. a cancelled generation
+            mock.count("cancelled")
+            self.close_connection = True
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mock Ollama server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11435)
+    parser.add_argument(
+        "--models", default=",".join(DEFAULT_MODELS), help="comma-separated model names"
+    )
+    parser.add_argument("--context-length", type=int, default=8192)
+    parser.add_argument(
+        "--ttft", type=float, default=0.05, help="seconds before the first token"
+    )
+    parser.add_argument(
+        "--tokens-per-second",
+        type=float,
+        default=100.0,
+        help="decode speed (0 = instant)",
+    )
+    parser.add_argument(
+        "--prompt-tokens-per-second",
+        type=float,
+        default=0.0,
+        help="prompt eval speed (0 = instant)",
+    )
+    parser.add_argument(
+        "--load-time", type=float, default=0.0, help="seconds to load a model"
+    )
+    parser.add_argument(
+        "--response-tokens", type=int, default=200, help="size of canned responses"
+    )
+    parser.add_argument("--response", help="fixed response text for every request")
+    parser.add_argument("--script", help="JSON file of {match, response, ...} rules")
+    parser.add_argument(
+        "--error-rate",
+        type=float,
+        default=0.0,
+        help="share of requests answered with HTTP 500",
+    )
+    parser.add_argument(
+        "--disconnect-rate",
+        type=float,
+        default=0.0,
+        help="share of streams dropped midway",
+    )
+    parser.add_argument(
+        "--num-parallel", type=int, default=4, help="requests served at once"
+    )
+    parser.add_argument("--seed", type=int, help="seed for failure injection")
+    parser.add_argument("--verbose", action="store_true", help="log every request")
+    args = parser.parse_args()
+
+    script = None
+    if args.script:
+        with open(args.script, encoding="utf-8") as f:
+            script = json.load(f)
+    server = MockOllama(
+        host=args.host,
+        port=args.port,
+        models=[m.strip() for m in args.models.split(",") if m.strip()],
+        context_length=args.context_length,
+        ttft=args.ttft,
+        tokens_per_second=args.tokens_per_second,
+        prompt_tokens_per_second=args.prompt_tokens_per_second,
+        load_time=args.load_time,
+        response_tokens=args.response_tokens,
+        response=args.response,
+        script=script,
+        error_rate=args.error_rate,
+        disconnect_rate=args.disconnect_rate,
+        num_parallel=args.num_parallel,
+        seed=args.seed,
+        verbose=args.verbose,
+    )
+    print(f"🧪 Mock Ollama serving {', '.join(server.models)} at {server.base_url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print(f"Mock Ollama stats: {server.stats}")
+
+
+if __name__ == "__main__":
+    main()
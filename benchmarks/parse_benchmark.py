@@ -0,0 +1,265 @@
+"""Micro-benchmark: single-pass response parsers vs the old regex cascades.
+
+Builds multi-megabyte model responses and times remove_code_block,
+parse_transformers_js_output and parse_svelte_output from main.py against
+the regex implementations they replaced (kept below for comparison).
+
+    python benchmarks/parse_benchmark.py [--mb 4] [--repeat 5]
+"""
+
+import argparse
+import os
+import re
+import sys
+import time
+from typing import Dict
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main  # noqa: E402
+
+# Regex parsers as they were before split_response
+
+
+def remove_code_block(text):
+    # Try to match code blocks with language markers
+    patterns = [
+        r"```(?:html|HTML)\n([\s\S]+?)\n```",  # Match ```html or ```HTML
+        r"```\n([\s\S]+?)\n```",  # Match code blocks without language markers
+        r"```([\s\S]+?)```",  # Match code blocks without line breaks
+    ]
+    for pattern in patterns:
+        match = re.search(pattern, text, re.DOTALL)
+        if match:
+            extracted = match.group(1).strip()
+            # Remove a leading language marker line (e.g., 'python') if present
+            if extracted.split("\n", 1)[0].strip().lower() in [
+                "python",
+                "html",
+                "css",
+                "javascript",
+                "json",
+                "c",
+                "cpp",
+                "markdown",
+                "latex",
+                "jinja2",
+                "typescript",
+                "yaml",
+                "dockerfile",
+                "shell",
+                "r",
+                "sql",
+                "sql-mssql",
+                "sql-mysql",
+                "sql-mariadb",
+                "sql-sqlite",
+                "sql-cassandra",
+                "sql-plSQL",
+                "sql-hive",
+                "sql-pgsql",
+                "sql-gql",
+                "sql-gpsql",
+                "sql-sparksql",
+                "sql-esper",
+            ]:
+                return extracted.split("\n", 1)[1] if "\n" in extracted else ""
+            return extracted
+    # If no code block is found, check if the entire text is HTML
+    if (
+        text.strip().startswith("<!DOCTYPE html>")
+        or text.strip().startswith("<html")
+        or text.strip().startswith("<")
+    ):
+        return text.strip()
+    # Special handling for python: remove python marker
+    if text.strip().startswith("```python"):
+        return text.strip()[9:-3].strip()
+    # Remove a leading language marker line if present (fallback)
+    lines = text.strip().split("\n", 1)
+    if lines[0].strip().lower() in [
+        "python",
+        "html",
+        "css",
+        "javascript",
+        "json",
+        "c",
+        "cpp",
+        "markdown",
+        "latex",
+        "jinja2",
+        "typescript",
+        "yaml",
+        "dockerfile",
+        "shell",
+        "r",
+        "sql",
+        "sql-mssql",
+        "sql-mysql",
+        "sql-mariadb",
+        "sql-sqlite",
+        "sql-cassandra",
+        "sql-plSQL",
+        "sql-hive",
+        "sql-pgsql",
+        "sql-gql",
+        "sql-gpsql",
+        "sql-sparksql",
+        "sql-esper",
+    ]:
+        return lines[1] if len(lines) > 1 else ""
+    return text.strip()
+
+
+def parse_transformers_js_output(text):
+    """Parse transformers.js output and extract the three files (index.html, index.js, style.css)"""
+    files = {"index.html": "", "index.js": "", "style.css": ""}
+
+    # Patterns to match the three code blocks
+    html_pattern = r"```html\s*\n([\s\S]+?)\n```"
+    js_pattern = r"```javascript\s*\n([\s\S]+?)\n```"
+    css_pattern = r"```css\s*\n([\s\S]+?)\n```"
+
+    # Extract HTML content
+    html_match = re.search(html_pattern, text, re.IGNORECASE)
+    if html_match:
+        files["index.html"] = html_match.group(1).strip()
+
+    # Extract JavaScript content
+    js_match = re.search(js_pattern, text, re.IGNORECASE)
+    if js_match:
+        files["index.js"] = js_match.group(1).strip()
+
+    # Extract CSS content
+    css_match = re.search(css_pattern, text, re.IGNORECASE)
+    if css_match:
+        files["style.css"] = css_match.group(1).strip()
+
+    # Fallback: support === index.html === format if any file is missing
+    if not (files["index.html"] and files["index.js"] and files["style.css"]):
+        # Use regex to extract sections
+        html_fallback = re.search(
+            r"===\s*index\.html\s*===\n([\s\S]+?)(?=\n===|$)", text, re.IGNORECASE
+        )
+        js_fallback = re.search(
+            r"===\s*index\.js\s*===\n([\s\S]+?)(?=\n===|$)", text, re.IGNORECASE
+        )
+        css_fallback = re.search(
+            r"===\s*style\.css\s*===\n([\s\S]+?)(?=\n===|$)", text, re.IGNORECASE
+        )
+        if html_fallback:
+            files["index.html"] = html_fallback.group(1).strip()
+        if js_fallback:
+            files["index.js"] = js_fallback.group(1).strip()
+        if css_fallback:
+            files["style.css"] = css_fallback.group(1).strip()
+
+    return files
+
+
+def parse_svelte_output(text):
+    """Parse Svelte output to extract individual files"""
+    files = {"src/App.svelte": "", "src/app.css": ""}
+
+    # First try to extract using code block patterns
+    svelte_pattern = r"```svelte\s*\n([\s\S]+?)\n```"
+    css_pattern = r"```css\s*\n([\s\S]+?)\n```"
+
+    # Extract svelte block for App.svelte
+    svelte_match = re.search(svelte_pattern, text, re.IGNORECASE)
+    css_match = re.search(css_pattern, text, re.IGNORECASE)
+
+    if svelte_match:
+        files["src/App.svelte"] = svelte_match.group(1).strip()
+    if css_match:
+        files["src/app.css"] = css_match.group(1).strip()
+
+    # Fallback: support === filename === format if any file is missing
+    if not (files["src/App.svelte"] and files["src/app.css"]):
+        # Use regex to extract sections
+        app_svelte_fallback = re.search(
+            r"===\s*src/App\.svelte\s*===\n([\s\S]+?)(?=\n===|$)", text, re.IGNORECASE
+        )
+        if app_svelte_fallback:
+            files["src/App.svelte"] = app_svelte_fallback.group(1).strip()
+        app_css_fallback = re.search(
+            r"===\s*src/app\.css\s*===\n([\s\S]+?)(?=\n===|$)", text, re.IGNORECASE
+        )
+        if app_css_fallback:
+            files["src/app.css"] = app_css_fallback.group(1).strip()
+
+    return files
+
+
+def make_responses(megabytes: float) -> Dict[str, str]:
+    """Responses of roughly ``megabytes`` MB for each output type."""
+    size = int(megabytes * 1024 * 1024)
+    html_line = '    <div class="card"><p>Lorem ipsum dolor sit amet</p></div>\n'
+    js_line = "  const value = await pipeline('sentiment-analysis', text);\n"
+    css_line = ".card { margin: 0 auto; padding: 1rem; color: #333; }\n"
+    html = html_line * (size // len(html_line))
+    third = size // 3
+    prose = "Here is the result.\n"
+    return {
+        "HTML": f"{prose}```html\n<html>\n{html}</html>\n```\nSome explanation.\n",
+        "Transformers.js": (
+            f"{prose}```html\n{html_line * (third // len(html_line))}```\n\n"
+            f"```javascript\n{js_line * (third // len(js_line))}```\n\n"
+            f"```css\n{css_line * (third // len(css_line))}```\n"
+        ),
+        "Transformers.js (sections)": (
+            f"=== index.html ===\n{html_line * (third // len(html_line))}"
+            f"=== index.js ===\n{js_line * (third // len(js_line))}"
+            f"=== style.css ===\n{css_line * (third // len(css_line))}"
+        ),
+        "Svelte": (
+            f"{prose}```svelte\n{html_line * (size // 2 // len(html_line))}```\n\n"
+            f"```css\n{css_line * (size // 2 // len(css_line))}```\n"
+        ),
+    }
+
+
+PARSERS = {
+    "HTML": (remove_code_block, main.remove_code_block),
+    "Transformers.js": (
+        parse_transformers_js_output,
+        main.parse_transformers_js_output,
+    ),
+    "Transformers.js (sections)": (
+        parse_transformers_js_output,
+        main.parse_transformers_js_output,
+    ),
+    "Svelte": (parse_svelte_output, main.parse_svelte_output),
+}
+
+
+def best_time(fn, text: str, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(text)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--mb", type=float, default=4.0, help="response size in MB")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"{'response':<28}{'size':>9}{'regex':>11}{'single-pass':>13}{'speedup':>9}")
+    for name, text in make_responses(args.mb).items():
+        old_fn, new_fn = PARSERS[name]
+        if old_fn(text) != new_fn(text):
+            print(f"{name}: parsers disagree")
+        old = best_time(old_fn, text, args.repeat)
+        new = best_time(new_fn, text, args.repeat)
+        print(
+            f"{name:<28}{len(text) / 1024 / 1024:>7.1f}MB"
+            f"{old * 1000:>9.1f}ms{new * 1000:>11.1f}ms{old / new:>8.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main_cli()
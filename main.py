@@ -1,8 +1,24 @@
 import os
 import re
-from typing import Dict, List, Tuple, Optional
+from typing import Callable, Dict, List, Tuple, Optional
 import requests
 import subprocess
+import threading
+import time
+import argparse
+import asyncio
+import hashlib
+import heapq
+import json
+import math
+import posixpath
+import itertools
+import queue
+import sqlite3
+import tempfile
+import zipfile
+from collections import OrderedDict, deque
+import httpx
 import ollama
 from tavily import TavilyClient
 import gradio as gr
@@ -17,6 +33,11 @@ except Exception:
     pytesseract = None
     OCR_AVAILABLE = False
 
+try:
+    import numpy as np
+except Exception:
+    np = None
+
 # Gradio supported languages for syntax highlighting
 GRADIO_SUPPORTED_LANGUAGES = [
     "python",
@@ -217,6 +238,40 @@ The style.css should contain all the styling for the application.
 
 Always output only the three code blocks as shown above, and do not include any explanations or extra text."""
 
+PROJECT_SYSTEM_PROMPT = """You are an expert software engineer creating a complete multi-file project for the user's request.
+
+Output every file of the project in the following format, one after the other:
+
+=== path/to/file.ext ===
+```language
+file content here
+```
+
+Requirements:
+1. Use paths relative to the project root (e.g. src/main.py, package.json, README.md)
+2. Include every file needed to run the project, and nothing else
+3. Write clean, idiomatic, runnable code following best practices for the chosen stack
+4. Keep each file complete; do not abbreviate or leave placeholders
+
+Always output only the files in the format above, and do not include any explanations or extra text."""
+
+PROJECT_SYSTEM_PROMPT_WITH_SEARCH = """You are an expert software engineer creating a complete multi-file project for the user's request. You have access to real-time web search. When needed, use web search to find the latest information, best practices, or specific library versions.
+
+Output every file of the project in the following format, one after the other:
+
+=== path/to/file.ext ===
+```language
+file content here
+```
+
+Requirements:
+1. Use paths relative to the project root (e.g. src/main.py, package.json, README.md)
+2. Include every file needed to run the project, and nothing else
+3. Write clean, idiomatic, runnable code following best practices for the chosen stack
+4. Keep each file complete; do not abbreviate or leave placeholders
+
+Always output only the files in the format above, and do not include any explanations or extra text."""
+
 GENERIC_SYSTEM_PROMPT = """You are an expert {language} developer. Write clean, idiomatic, and runnable {language} code for the user's request. If possible, include comments and best practices. Output ONLY the code inside a ``` code block, and do not include any explanations or extra text. If the user provides a file or other context, use it as a reference. If the code is for a script or app, make it as self-contained as possible. Do NOT add the language name at the top of the code output."""
 
 # System prompt with search capability
@@ -343,6 +398,15 @@ body {{
 {REPLACE_END}
 ```"""
 
+# System prompt for summarizing older turns of a long session
+COMPACTION_SYSTEM_PROMPT = """You summarize a coding session between a user and an AI code generator. Write a concise summary (at most 200 words) of what the user asked for and every change they requested, in order, so the work can continue without the original messages. Do not include any code."""
+
+# Follow-up system prompts for output types that support SEARCH/REPLACE edits
+FOLLOW_UP_PROMPTS = {
+    "HTML": FollowUpSystemPrompt,
+    "Transformers.js": TransformersJSFollowUpSystemPrompt,
+}
+
 # Available Ollama models - Update this list with your downloaded models
 AVAILABLE_MODELS = [
     {
@@ -469,52 +533,651 @@ DEMO_LIST = [
 ]
 
 # Ollama Configuration
-OLLAMA_BASE_URL = os.getenv("OLLAMA_BASE_URL", "http://localhost:11434")
+# OLLAMA_BASE_URL may list several hosts separated by commas; requests are
+# routed across them by OllamaRouter
+OLLAMA_HOSTS = [
+    h.strip().rstrip("/")
+    for h in os.getenv("OLLAMA_BASE_URL", "http://localhost:11434").split(",")
+    if h.strip()
+] or ["http://localhost:11434"]
+OLLAMA_BASE_URL = OLLAMA_HOSTS[0]
+# Seconds between background health probes of the Ollama HTTP API
+OLLAMA_HEALTH_TTL = float(os.getenv("OLLAMA_HEALTH_TTL", "15"))
+# Maximum number of pooled keep-alive connections to Ollama
+OLLAMA_POOL_SIZE = int(os.getenv("OLLAMA_POOL_SIZE", "16"))
+# Read timeout (seconds) for a single generation request
+OLLAMA_REQUEST_TIMEOUT = float(os.getenv("OLLAMA_REQUEST_TIMEOUT", "600"))
+# Stream tokens to the UI as they are generated (set to 0 to wait for full responses)
+STREAM_RESPONSES = os.getenv("OLLAMA_STREAM", "1") != "0"
+# How long Ollama keeps a model in memory after a request ("30m", "1h", -1 =
+# forever) and per-model overrides, e.g. "llava:13b=5m,codellama:7b=-1"
+OLLAMA_KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "30m")
+OLLAMA_KEEP_ALIVE_OVERRIDES = dict(
+    item.rsplit("=", 1)
+    for item in os.getenv("OLLAMA_KEEP_ALIVE_OVERRIDES", "").split(",")
+    if "=" in item
+)
+# Preload the default model at launch and models picked in the dropdown
+OLLAMA_WARMUP = os.getenv("OLLAMA_WARMUP", "1") != "0"
+# Admission control: concurrent generations per model, queued requests per
+# model, and the longest a request may wait in the queue (seconds)
+OLLAMA_MAX_CONCURRENT_PER_MODEL = int(os.getenv("OLLAMA_MAX_CONCURRENT_PER_MODEL", "2"))
+OLLAMA_MAX_QUEUE_PER_MODEL = int(os.getenv("OLLAMA_MAX_QUEUE_PER_MODEL", "32"))
+OLLAMA_QUEUE_TIMEOUT = float(os.getenv("OLLAMA_QUEUE_TIMEOUT", "120"))
+# Share one generation between identical concurrent requests
+OLLAMA_SINGLE_FLIGHT = os.getenv("OLLAMA_SINGLE_FLIGHT", "1") != "0"
+# Cache deterministic generations (temperature 0 or a fixed seed) in memory
+# and in a SQLite file that survives restarts; sizes are in megabytes
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE", "1") != "0"
+RESPONSE_CACHE_PATH = os.getenv(
+    "RESPONSE_CACHE_PATH",
+    os.path.join(
+        os.path.expanduser("~"), ".cache", "ollama-coder", "responses.sqlite3"
+    ),
+)
+RESPONSE_CACHE_MEMORY_MB = float(os.getenv("RESPONSE_CACHE_MEMORY_MB", "64"))
+RESPONSE_CACHE_DISK_MB = float(os.getenv("RESPONSE_CACHE_DISK_MB", "512"))
+# Semantic cache: serve cached code for paraphrased first-turn prompts. Prompts
+# are embedded with a local sentence-transformers model (EMBEDDING_MODEL), or
+# with an Ollama embedding model if SEMANTIC_CACHE_OLLAMA_MODEL is set
+SEMANTIC_CACHE_ENABLED = os.getenv("SEMANTIC_CACHE", "0") == "1"
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "sentence-transformers/all-MiniLM-L6-v2")
+SEMANTIC_CACHE_OLLAMA_MODEL = os.getenv("SEMANTIC_CACHE_OLLAMA_MODEL")
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.92"))
+SEMANTIC_CACHE_MAX_ENTRIES = int(os.getenv("SEMANTIC_CACHE_MAX_ENTRIES", "512"))
+# Context window management: cap on prompt + output tokens (0 = the model's own
+# context length), tokens kept free for the answer, and the smallest num_ctx
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "0"))
+OUTPUT_TOKEN_RESERVE = int(os.getenv("OUTPUT_TOKEN_RESERVE", "4096"))
+MIN_NUM_CTX = int(os.getenv("MIN_NUM_CTX", "2048"))
+# Used when a model's context length cannot be read from /api/show
+DEFAULT_CONTEXT_LENGTH = int(os.getenv("DEFAULT_CONTEXT_LENGTH", "8192"))
+# Compaction of long sessions: once the prompt passes the threshold, older
+# turns are summarized in the background by a small model and replaced in the
+# prompt by the summary and the latest code; the newest turns stay verbatim
+COMPACTION_ENABLED = os.getenv("COMPACTION", "0") == "1"
+COMPACTION_MODEL = os.getenv("COMPACTION_MODEL", "llama3.2:3b")
+COMPACTION_THRESHOLD_TOKENS = int(os.getenv("COMPACTION_THRESHOLD_TOKENS", "6000"))
+COMPACTION_KEEP_TURNS = int(os.getenv("COMPACTION_KEEP_TURNS", "1"))
+# Apply follow-up edits as SEARCH/REPLACE patches instead of regenerating files
+DIFF_EDITS_ENABLED = os.getenv("DIFF_EDITS", "1") != "0"
+# Stop generating as soon as the code blocks the output type expects are closed
+EARLY_STOP_ENABLED = os.getenv("EARLY_STOP", "1") != "0"
+# "Current artifact only" context: earlier code versions are left out of the
+# prompt and only the latest code is sent with the new instruction
+ARTIFACT_CONTEXT_ENABLED = os.getenv("ARTIFACT_CONTEXT", "0") == "1"
+# Log prompt evaluation stats (prompt_eval_count/duration) for every generation
+LOG_GENERATION_STATS = os.getenv("LOG_GENERATION_STATS", "1") != "0"
+# Streamed UI updates: frames per second for chat and code, and for the HTML
+# preview iframe (0 = only render the preview when generation ends)
+UI_FRAME_RATE = float(os.getenv("UI_FRAME_RATE", "15"))
+PREVIEW_FRAME_RATE = float(os.getenv("PREVIEW_FRAME_RATE", "2"))
+# Serve Prometheus metrics at /metrics on the Gradio server
+METRICS_ENABLED = os.getenv("METRICS", "1") != "0"
+# Gradio queue: concurrent generation events per worker and maximum queued events
+GRADIO_CONCURRENCY_LIMIT = int(os.getenv("GRADIO_CONCURRENCY_LIMIT", "32"))
+GRADIO_MAX_QUEUE_SIZE = int(os.getenv("GRADIO_MAX_QUEUE_SIZE", "256"))
+
+
+class GenerationCancelled(Exception):
+    """Raised to consumers of ENGINE_LOOP.iterate/aiterate when the producer
+    was cancelled, so a cut-off stream isn't mistaken for a finished one."""
+
+
+class EventLoopThread:
+    """Private asyncio event loop running in a daemon thread.
+
+    All async Ollama I/O runs on this loop, so loop-bound objects (the async
+    client, locks, queues) are shared by sync callers and async Gradio handlers.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._lock = threading.Lock()
+
+    @property
+    def loop(self) -> asyncio.AbstractEventLoop:
+        if self._loop is None:
+            with self._lock:
+                if self._loop is None:
+                    loop = asyncio.new_event_loop()
+                    threading.Thread(
+                        target=loop.run_forever, name=self.name, daemon=True
+                    ).start()
+                    self._loop = loop
+        return self._loop
+
+    def submit(self, coro):
+        """Schedule a coroutine on the loop and return a concurrent Future."""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def run(self, coro, timeout: Optional[float] = None):
+        """Run a coroutine on the loop and block until it finishes."""
+        return self.submit(coro).result(timeout)
+
+    async def arun(self, coro):
+        """Await a coroutine on the loop from another event loop."""
+        return await asyncio.wrap_future(self.submit(coro))
+
+    @staticmethod
+    async def _pump(agen, put):
+        try:
+            async for item in agen:
+                put(("item", item))
+        except asyncio.CancelledError:
+            # Ends the consumer too if the producer was cancelled elsewhere
+            put(("cancelled", None))
+            raise
+        except Exception as e:
+            put(("error", e))
+            return
+        finally:
+            await agen.aclose()
+        put(("done", None))
+
+    def iterate(self, agen):
+        """Consume an async generator on the loop as a plain generator.
+
+        Closing the returned generator cancels the producer on the loop; if
+        the producer is cancelled elsewhere, GenerationCancelled is raised.
+        """
+        items: "queue.Queue" = queue.Queue()
+        future = self.submit(self._pump(agen, items.put))
+        try:
+            while True:
+                kind, value = items.get()
+                if kind == "done":
+                    return
+                if kind == "cancelled":
+                    raise GenerationCancelled()
+                if kind == "error":
+                    raise value
+                yield value
+        finally:
+            future.cancel()
+
+    async def aiterate(self, agen):
+        """Consume an async generator on the loop from another event loop."""
+        caller_loop = asyncio.get_running_loop()
+        items: "asyncio.Queue" = asyncio.Queue()
+        future = self.submit(
+            self._pump(
+                agen,
+                lambda item: caller_loop.call_soon_threadsafe(items.put_nowait, item),
+            )
+        )
+        try:
+            while True:
+                kind, value = await items.get()
+                if kind == "done":
+                    return
+                if kind == "cancelled":
+                    raise GenerationCancelled()
+                if kind == "error":
+                    raise value
+                yield value
+        finally:
+            future.cancel()
+
+
+ENGINE_LOOP = EventLoopThread("ollama-engine")
+
+
+class OllamaClientManager:
+    """Process-wide Ollama client with a pooled connection and cached health state.
+
+    The shared client keeps its TCP connections alive between requests. Health is
+    probed by a background thread every ``health_ttl`` seconds, so ``get_client()``
+    answers from memory and never does network I/O except on the very first call.
+    """
+
+    def __init__(self, host: str, health_ttl: float, pool_size: int):
+        self.host = host
+        self.health_ttl = health_ttl
+        self.pool_size = pool_size
+        self._client = ollama.Client(host=host, **self._http_options())
+        # Created on first use; only ever used from ENGINE_LOOP
+        self._async_client: Optional[ollama.AsyncClient] = None
+        # Separate keep-alive session for cheap health probes
+        self._probe_session = requests.Session()
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._refresher: Optional[threading.Thread] = None
+        self.healthy: Optional[bool] = None
+        self.checked_at = 0.0
+        self.last_error: Optional[str] = None
+        # Models installed on / currently loaded into memory on this host
+        self.installed: List[str] = []
+        self.digests: Dict[str, Optional[str]] = {}
+        self.resident: set = set()
+        self.in_flight = 0
+
+    def _http_options(self) -> Dict:
+        return {
+            "timeout": httpx.Timeout(OLLAMA_REQUEST_TIMEOUT, connect=5.0),
+            "limits": httpx.Limits(
+                max_connections=self.pool_size,
+                max_keepalive_connections=self.pool_size,
+            ),
+        }
+
+    def _probe_models(self, path: str) -> Dict[str, Optional[str]]:
+        """Return {model name: digest} from /api/tags or /api/ps."""
+        response = self._probe_session.get(f"{self.host}{path}", timeout=5)
+        response.raise_for_status()
+        models = {}
+        for m in response.json().get("models", []):
+            if isinstance(m, dict):
+                name = m.get("name") or m.get("model")
+                if name:
+                    models[str(name)] = m.get("digest")
+            elif m:
+                models[str(m)] = None
+        return models
+
+    def check_health(self) -> bool:
+        """Probe /api/tags and /api/ps once and record the result."""
+        installed, resident = self.installed, self.resident
+        digests = self.digests
+        try:
+            digests = self._probe_models("/api/tags")
+            installed = list(digests)
+            healthy, error = True, None
+            try:
+                resident = set(self._probe_models("/api/ps"))
+            except Exception:
+                # Older Ollama versions have no /api/ps; routing still works
+                resident = set()
+        except Exception as e:
+            healthy, error = False, str(e)
+
+        with self._lock:
+            if error and error != self.last_error:
+                print(f"Ollama connection error ({self.host}): {error}")
+            self.healthy = healthy
+            self.last_error = error
+            self.installed = installed
+            self.digests = digests
+            self.resident = resident
+            self.checked_at = time.monotonic()
+        return healthy
+
+    def report_failure(self, error: Exception):
+        """Mark the host unhealthy after a failed request and re-probe soon."""
+        with self._lock:
+            self.healthy = False
+            self.last_error = str(error)
+        self._wakeup.set()
+
+    def _refresh_loop(self):
+        while True:
+            self._wakeup.wait(self.health_ttl)
+            self._wakeup.clear()
+            self.check_health()
+
+    def _ensure_refresher(self):
+        if self._refresher is not None:
+            return
+        with self._lock:
+            if self._refresher is None:
+                self._refresher = threading.Thread(
+                    target=self._refresh_loop, name="ollama-health", daemon=True
+                )
+                self._refresher.start()
+
+    def get_client(self) -> Optional[ollama.Client]:
+        """Return the shared client if Ollama is believed healthy, else None."""
+        if self.healthy is None:
+            self.check_health()
+        self._ensure_refresher()
+        if not self.healthy:
+            # Ask the refresher to re-probe now instead of waiting a full TTL
+            self._wakeup.set()
+            return None
+        return self._client
+
+    def get_async_client(self) -> Optional[ollama.AsyncClient]:
+        """Return the shared async client if Ollama is believed healthy, else None.
+
+        Must be called from ENGINE_LOOP, which owns the async connection pool.
+        """
+        if self.get_client() is None:
+            return None
+        if self._async_client is None:
+            self._async_client = ollama.AsyncClient(
+                host=self.host, **self._http_options()
+            )
+        return self._async_client
+
+
+class OllamaRouter:
+    """Route requests across several Ollama hosts.
+
+    A request for a model goes to a healthy host that has the model installed,
+    preferring hosts where it is already resident in memory, then the host with
+    the fewest in-flight requests. Failed hosts are ejected until the background
+    health probe sees them recover.
+    """
+
+    def __init__(self, managers: List[OllamaClientManager]):
+        self.managers = managers
+        self._lock = threading.Lock()
+
+    def ensure_probed(self):
+        """Probe hosts that have never been checked, in parallel."""
+        pending = [m for m in self.managers if m.healthy is None]
+        threads = [threading.Thread(target=m.get_client) for m in pending]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+    def healthy_managers(self) -> List[OllamaClientManager]:
+        self.ensure_probed()
+        return [m for m in self.managers if m.get_client() is not None]
+
+    def select(self, model_id: Optional[str] = None) -> Optional[OllamaClientManager]:
+        """Pick the best healthy host for ``model_id`` (or any healthy host)."""
+        candidates = self.healthy_managers()
+        if model_id:
+            # Fall back to every healthy host if none reports the model
+            candidates = [
+                m for m in candidates if model_id in m.installed
+            ] or candidates
+        if not candidates:
+            return None
+        return min(
+            candidates,
+            key=lambda m: (model_id not in m.resident, m.in_flight),
+        )
+
+    def acquire(self, manager: OllamaClientManager, model_id: str):
+        with self._lock:
+            manager.in_flight += 1
+            # Ollama loads the model on first use, so count it as resident now
+            manager.resident.add(model_id)
+
+    def release(self, manager: OllamaClientManager):
+        with self._lock:
+            manager.in_flight -= 1
+
+    def model_digest(self, model_id: str) -> Optional[str]:
+        """Digest of ``model_id`` as reported by a healthy host, if known."""
+        for manager in self.healthy_managers():
+            digest = manager.digests.get(model_id)
+            if digest:
+                return digest
+        return None
+
+    def installed_models(self) -> List[str]:
+        """Merged, de-duplicated list of models installed across healthy hosts."""
+        merged: Dict[str, None] = {}
+        for manager in self.healthy_managers():
+            for name in manager.installed:
+                merged.setdefault(name, None)
+        return list(merged)
 
 
-def get_ollama_client():
-    """Return an Ollama client if the Ollama HTTP API is reachable, else None."""
+OLLAMA_ROUTER = OllamaRouter(
+    [
+        OllamaClientManager(host, OLLAMA_HEALTH_TTL, OLLAMA_POOL_SIZE)
+        for host in OLLAMA_HOSTS
+    ]
+)
+
+
+def get_ollama_client(model_id: Optional[str] = None):
+    """Return a pooled Ollama client for a healthy host (preferring one suited to
+    ``model_id``), or None if no Ollama host is reachable."""
+    manager = OLLAMA_ROUTER.select(model_id)
+    return manager.get_client() if manager else None
+
+
+def get_keep_alive(model_id: str):
+    """Return the keep_alive policy for a model (seconds as int, or a duration string)."""
+    value = OLLAMA_KEEP_ALIVE_OVERRIDES.get(model_id, OLLAMA_KEEP_ALIVE).strip()
     try:
-        # Test if Ollama HTTP API is reachable
-        response = requests.get(f"{OLLAMA_BASE_URL}/api/tags", timeout=5)
-        if response.status_code == 200:
-            return ollama.Client(host=OLLAMA_BASE_URL)
-        return None
+        return int(value)
+    except ValueError:
+        return value
+
+
+class ModelWarmer:
+    """Preload models into Ollama memory so cold loads happen off the request path.
+
+    Warm-ups run on ENGINE_LOOP; concurrent warm-ups of the same model share one
+    load request.
+    """
+
+    def __init__(self, router: OllamaRouter):
+        self.router = router
+        self.states: Dict[str, Dict] = {}
+        self._tasks: Dict[str, asyncio.Task] = {}
+
+    async def _load(self, model_id: str):
+        manager = self.router.select(model_id)
+        client = manager.get_async_client() if manager else None
+        if not client:
+            self.states[model_id] = {"state": "error", "error": "Ollama is not running"}
+            return
+
+        self.states[model_id] = {"state": "loading", "host": manager.host}
+        start = time.monotonic()
+        try:
+            # An empty prompt makes Ollama load the model without generating
+            await client.generate(
+                model=model_id,
+                prompt="",
+                keep_alive=get_keep_alive(model_id),
+                options={"num_ctx": await default_num_ctx(model_id)},
+            )
+            manager.resident.add(model_id)
+            self.states[model_id] = {
+                "state": "ready",
+                "host": manager.host,
+                "load_seconds": time.monotonic() - start,
+            }
+        except Exception as e:
+            self.states[model_id] = {"state": "error", "error": str(e)}
+
+    async def warm(self, model_id: str) -> Dict:
+        """Load ``model_id`` unless it is already resident; returns its state."""
+        manager = self.router.select(model_id)
+        if manager and model_id in manager.resident:
+            self.states.setdefault(model_id, {"state": "ready", "host": manager.host})
+            return self.states[model_id]
+
+        task = self._tasks.get(model_id)
+        if task is None or task.done():
+            task = asyncio.ensure_future(self._load(model_id))
+            self._tasks[model_id] = task
+        await asyncio.shield(task)
+        return self.states[model_id]
+
+    def warm_in_background(self, model_id: str):
+        """Start warming ``model_id`` without waiting for it."""
+        ENGINE_LOOP.submit(self.warm(model_id))
+
+    def describe(self, model_id: str) -> str:
+        """Short Markdown status line for the UI."""
+        info = self.states.get(model_id, {})
+        state = info.get("state")
+        if state == "ready":
+            if "load_seconds" in info:
+                return f"✅ `{model_id}` loaded in {info['load_seconds']:.1f}s"
+            return f"✅ `{model_id}` is loaded"
+        if state == "error":
+            return f"⚠️ Could not preload `{model_id}`: {info.get('error')}"
+        return f"⏳ Loading `{model_id}` into memory..."
+
+
+MODEL_WARMER = ModelWarmer(OLLAMA_ROUTER)
+
+
+# Maximum context length per model, read from /api/show
+MODEL_CONTEXT_LENGTHS: Dict[str, int] = {}
+
+
+async def get_context_length(model_id: str) -> int:
+    """Return the model's maximum context length (cached; runs on ENGINE_LOOP)."""
+    if model_id in MODEL_CONTEXT_LENGTHS:
+        return MODEL_CONTEXT_LENGTHS[model_id]
+    manager = OLLAMA_ROUTER.select(model_id)
+    client = manager.get_async_client() if manager else None
+    if not client:
+        return DEFAULT_CONTEXT_LENGTH
+
+    length = DEFAULT_CONTEXT_LENGTH
+    try:
+        response = await client.show(model_id)
+        info = (
+            _response_field(response, "modelinfo")
+            or _response_field(response, "model_info")
+            or {}
+        )
+        for key, value in info.items():
+            if key.endswith(".context_length"):
+                length = int(value)
+                break
     except Exception as e:
-        print(f"Ollama connection error: {e}")
-        return None
+        print(f"Could not read context length of {model_id}: {e}")
+    MODEL_CONTEXT_LENGTHS[model_id] = length
+    return length
+
+
+def choose_num_ctx(prompt_tokens: int, context_limit: int, reserve: int) -> int:
+    """Smallest power-of-two num_ctx that fits the prompt plus the output reserve.
+
+    Ollama reloads a model whenever num_ctx changes, so sizes are bucketed to
+    keep the number of distinct values small.
+    """
+    num_ctx = MIN_NUM_CTX
+    while num_ctx < prompt_tokens + reserve:
+        num_ctx *= 2
+    return min(num_ctx, context_limit)
+
+
+async def context_window(model_id: str) -> Tuple[int, int]:
+    """(context_limit, output_reserve) used to size prompts for ``model_id``."""
+    context_limit = await get_context_length(model_id)
+    if CONTEXT_TOKEN_BUDGET:
+        context_limit = min(context_limit, CONTEXT_TOKEN_BUDGET)
+    return context_limit, min(OUTPUT_TOKEN_RESERVE, context_limit // 2)
+
+
+async def default_num_ctx(model_id: str) -> int:
+    """num_ctx of the smallest bucket a (non-empty) chat prompt can get.
+
+    Warm-ups send it too, so they load the model with the same num_ctx as
+    the chats that follow and don't force a reload.
+    """
+    context_limit, reserve = await context_window(model_id)
+    return choose_num_ctx(1, context_limit, reserve)
+
+
+class AdmissionError(Exception):
+    """Raised when a generation request is rejected by admission control."""
+
+
+class AdmissionController:
+    """Per-model concurrency cap with a bounded priority queue in front of Ollama.
+
+    Lives on ENGINE_LOOP. Waiters are served by (priority, arrival) order, so a
+    lower priority number goes first and equal priorities are FIFO.
+    """
+
+    def __init__(self, max_concurrent: int, max_queue: int, queue_timeout: float):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self._active: Dict[str, int] = {}
+        self._waiting: Dict[str, List] = {}
+        self._seq = itertools.count()
+
+    def models(self) -> List[str]:
+        """Models that have been admitted or queued so far."""
+        return sorted(set(self._active) | set(self._waiting))
+
+    def queue_depth(self, model_id: str) -> int:
+        return len(self._waiting.get(model_id, []))
+
+    def active(self, model_id: str) -> int:
+        return self._active.get(model_id, 0)
+
+    async def wait_for_slot(self, model_id: str, priority: int = 0):
+        """Async generator that yields the 1-based queue position while waiting
+        and finishes once a slot is held. Call release() when done."""
+        waiting = self._waiting.setdefault(model_id, [])
+        if not waiting and self.active(model_id) < self.max_concurrent:
+            self._active[model_id] = self.active(model_id) + 1
+            return
+        if len(waiting) >= self.max_queue:
+            raise AdmissionError(
+                f"Too many requests queued for {model_id}; please try again shortly."
+            )
+
+        loop = asyncio.get_running_loop()
+        ticket = [priority, next(self._seq), loop.create_future()]
+        heapq.heappush(waiting, ticket)
+        deadline = loop.time() + self.queue_timeout
+        last_position = None
+        try:
+            while True:
+                position = sorted(waiting).index(ticket) + 1
+                if position != last_position:
+                    last_position = position
+                    yield position
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    raise AdmissionError(
+                        f"Timed out after {self.queue_timeout:g}s waiting for {model_id}."
+                    )
+                try:
+                    # Wake up at least once a second to report the new position
+                    await asyncio.wait_for(
+                        asyncio.shield(ticket[2]), min(remaining, 1.0)
+                    )
+                    return
+                except asyncio.TimeoutError:
+                    continue
+        except BaseException:
+            if ticket[2].done() and not ticket[2].cancelled():
+                # The slot was handed over just as we gave up; pass it on
+                self.release(model_id)
+            else:
+                ticket[2].cancel()
+                waiting.remove(ticket)
+                heapq.heapify(waiting)
+            raise
+
+    def release(self, model_id: str):
+        """Give the slot to the next waiter, or free it."""
+        waiting = self._waiting.get(model_id, [])
+        while waiting:
+            ticket = heapq.heappop(waiting)
+            if not ticket[2].done():
+                ticket[2].set_result(True)
+                return
+        self._active[model_id] = max(0, self.active(model_id) - 1)
+
+
+ADMISSION = AdmissionController(
+    OLLAMA_MAX_CONCURRENT_PER_MODEL, OLLAMA_MAX_QUEUE_PER_MODEL, OLLAMA_QUEUE_TIMEOUT
+)
 
 
 def get_available_ollama_models():
-    """Get list of available Ollama models using the Python client or fallback to the `ollama` CLI."""
+    """Get the merged list of models installed across all Ollama hosts, falling
+    back to the `ollama` CLI."""
     models_list = []
     try:
-        client = get_ollama_client()
-        if client:
-            models_resp = client.list()
-            # support dict with 'models' key, list, or iterable
-            if isinstance(models_resp, dict) and "models" in models_resp:
-                models = models_resp["models"]
-            elif isinstance(models_resp, list):
-                models = models_resp
-            else:
-                try:
-                    models = list(models_resp)
-                except Exception:
-                    models = []
-
-            for m in models:
-                if isinstance(m, str):
-                    models_list.append(m)
-                elif isinstance(m, dict):
-                    for key in ("name", "id", "tag"):
-                        if key in m:
-                            models_list.append(m[key])
-                            break
-            if models_list:
-                return models_list
+        # Served from the cached health probes; no extra network round trip
+        models_list = OLLAMA_ROUTER.installed_models()
+        if models_list:
+            return models_list
     except Exception as e:
-        print(f"Error getting Ollama models via client: {e}")
+        print(f"Error getting Ollama models from hosts: {e}")
 
     # Fallback to CLI
     try:
@@ -620,21 +1283,89 @@ if TAVILY_API_KEY:
         tavily_client = None
 
 
-def history_to_messages(history: History, system: str) -> Messages:
-    messages = [{"role": "system", "content": system}]
+class TokenEstimator:
+    """Per-model token counts estimated from character length.
+
+    The characters-per-token ratio starts conservative and is calibrated from
+    each generation's output (eval_count vs. generated characters), which is
+    never affected by Ollama's prompt cache.
+    """
+
+    # Per-message overhead of the chat template (role markers, separators)
+    MESSAGE_OVERHEAD = 4
+
+    def __init__(self, default_chars_per_token: float = 3.0):
+        self.default_chars_per_token = default_chars_per_token
+        self.ratios: Dict[str, float] = {}
+
+    def count(self, model_id: str, text: str) -> int:
+        return self.output_tokens(model_id, text) + self.MESSAGE_OVERHEAD
+
+    def output_tokens(self, model_id: str, text: str) -> int:
+        """Tokens generated for ``text``, without the chat template overhead."""
+        ratio = self.ratios.get(model_id, self.default_chars_per_token)
+        return math.ceil(len(text) / ratio)
+
+    def counter(self, model_id: str) -> Callable[[str], int]:
+        return lambda text: self.count(model_id, text)
+
+    def calibrate(self, model_id: str, chars: int, tokens: int):
+        if chars < 200 or not tokens:
+            return
+        observed = min(8.0, max(1.5, chars / tokens))
+        current = self.ratios.get(model_id, observed)
+        self.ratios[model_id] = 0.8 * current + 0.2 * observed
+
+
+TOKEN_ESTIMATOR = TokenEstimator()
+
+
+def _text_content(content) -> str:
+    """Extract the text of a possibly multimodal message content."""
+    if isinstance(content, list):
+        text_content = ""
+        for item in content:
+            if isinstance(item, dict) and item.get("type") == "text":
+                text_content += item.get("text", "")
+        return text_content if text_content else str(content)
+    return content
+
+
+def history_to_messages(
+    history: History,
+    system: str,
+    token_budget: Optional[int] = None,
+    count_tokens: Optional[Callable[[str], int]] = None,
+) -> Messages:
+    """Convert history to chat messages.
+
+    With ``token_budget`` and ``count_tokens``, the oldest turns are dropped
+    until the messages fit the budget; the most recent turn is always kept.
+    """
+    turns = []
     for h in history:
         # Handle multimodal content in history
-        user_content = h[0]
-        if isinstance(user_content, list):
-            # Extract text from multimodal content
-            text_content = ""
-            for item in user_content:
-                if isinstance(item, dict) and item.get("type") == "text":
-                    text_content += item.get("text", "")
-            user_content = text_content if text_content else str(user_content)
+        turns.append(
+            [
+                {"role": "user", "content": _text_content(h[0])},
+                {"role": "assistant", "content": h[1]},
+            ]
+        )
+
+    if token_budget is not None and count_tokens is not None and turns:
+        sizes = [sum(count_tokens(m["content"] or "") for m in turn) for turn in turns]
+        total = count_tokens(system) + sum(sizes)
+        dropped = 0
+        while total > token_budget and dropped < len(turns) - 1:
+            total -= sizes[dropped]
+            dropped += 1
+        if dropped:
+            print(f"✂️  Dropped {dropped} oldest turn(s) to fit {token_budget} tokens")
+            turns = turns[dropped:]
 
-        messages.append({"role": "user", "content": user_content})
-        messages.append({"role": "assistant", "content": h[1]})
+    messages = [{"role": "system", "content": system}]
+    for turn in turns:
+        messages.extend(turn)
     return messages
 
 
@@ -655,6 +1386,57 @@ def messages_to_history(messages: Messages) -> Tuple[str, History]:
     return history
 
 
+# Volatile per-turn material (search results, OCR text) follows this marker at
+# the end of the user message, after the user's own instruction
+CONTEXT_MARKER = "\n\n[Context for this request]\n"
+
+
+def assemble_messages(
+    history: History,
+    system_prompt: str,
+    message: str,
+    context: Optional[List[Tuple[str, str]]] = None,
+    token_budget: Optional[int] = None,
+    count_tokens: Optional[Callable[[str], int]] = None,
+) -> Tuple[str, Messages]:
+    """Build the prompt for a new turn with stable content first.
+
+    The system prompt and earlier turns are replayed exactly as they were sent,
+    and volatile ``context`` sections (title, text) go at the very end, so
+    Ollama can reuse its KV cache for everything before the new turn. Returns
+    the user content as sent; store it in history verbatim so the next turn's
+    prefix stays byte-identical. With ``token_budget`` the oldest turns are
+    dropped so the whole prompt fits.
+    """
+    sections = [f"{title}:\n{text}" for title, text in context or [] if text]
+    sent_message = message
+    if sections:
+        sent_message = message + CONTEXT_MARKER + "\n\n".join(sections)
+
+    if token_budget is not None and count_tokens is not None:
+        token_budget -= count_tokens(sent_message)
+    messages = history_to_messages(history, system_prompt, token_budget, count_tokens)
+    messages.append({"role": "user", "content": sent_message})
+    return sent_message, messages
+
+
+# Stands in for earlier code versions in "current artifact only" prompts
+ARTIFACT_PLACEHOLDER = "[Earlier code version omitted]"
+
+
+def artifact_only_history(history: History) -> History:
+    """History with earlier code versions and per-turn context left out.
+
+    Only the user's instructions are kept and every assistant turn is replaced
+    by ARTIFACT_PLACEHOLDER, so earlier edits no longer add a copy of the code
+    each to the prompt. The current code goes with the new request instead.
+    """
+    return [
+        [str(_text_content(user_msg)).split(CONTEXT_MARKER, 1)[0], ARTIFACT_PLACEHOLDER]
+        for user_msg, _ in history
+    ]
+
+
 def history_to_chatbot_messages(history: History) -> List[Dict[str, str]]:
     """Convert history tuples to chatbot message format"""
     messages = []
@@ -668,6 +1450,8 @@ def history_to_chatbot_messages(history: History) -> List[Dict[str, str]]:
             user_text = text_content if text_content else str(user_msg)
         else:
             user_text = str(user_msg) if user_msg is not None else ""
+        # Show only the user's instruction, not the context sent with it
+        user_text = user_text.split(CONTEXT_MARKER, 1)[0]
 
         # Normalize assistant message to a plain string
         if isinstance(assistant_msg, list):
@@ -686,63 +1470,23 @@ def history_to_chatbot_messages(history: History) -> List[Dict[str, str]]:
     return messages
 
 
-def remove_code_block(text):
-    # Try to match code blocks with language markers
-    patterns = [
-        r"```(?:html|HTML)\n([\s\S]+?)\n```",  # Match ```html or ```HTML
-        r"```\n([\s\S]+?)\n```",  # Match code blocks without language markers
-        r"```([\s\S]+?)```",  # Match code blocks without line breaks
-    ]
-    for pattern in patterns:
-        match = re.search(pattern, text, re.DOTALL)
-        if match:
-            extracted = match.group(1).strip()
-            # Remove a leading language marker line (e.g., 'python') if present
-            if extracted.split("\n", 1)[0].strip().lower() in [
-                "python",
-                "html",
-                "css",
-                "javascript",
-                "json",
-                "c",
-                "cpp",
-                "markdown",
-                "latex",
-                "jinja2",
-                "typescript",
-                "yaml",
-                "dockerfile",
-                "shell",
-                "r",
-                "sql",
-                "sql-mssql",
-                "sql-mysql",
-                "sql-mariadb",
-                "sql-sqlite",
-                "sql-cassandra",
-                "sql-plSQL",
-                "sql-hive",
-                "sql-pgsql",
-                "sql-gql",
-                "sql-gpsql",
-                "sql-sparksql",
-                "sql-esper",
-            ]:
-                return extracted.split("\n", 1)[1] if "\n" in extracted else ""
-            return extracted
-    # If no code block is found, check if the entire text is HTML
-    if (
-        text.strip().startswith("<!DOCTYPE html>")
-        or text.strip().startswith("<html")
-        or text.strip().startswith("<")
-    ):
-        return text.strip()
-    # Special handling for python: remove python marker
-    if text.strip().startswith("```python"):
-        return text.strip()[9:-3].strip()
-    # Remove a leading language marker line if present (fallback)
-    lines = text.strip().split("\n", 1)
-    if lines[0].strip().lower() in [
+# Fenced blocks the multi-file output types must produce and the file each one
+# holds; every other output type is complete after its first closed block
+CODE_BLOCK_FILES = {
+    "Transformers.js": {
+        "html": "index.html",
+        "javascript": "index.js",
+        "css": "style.css",
+    },
+    "Svelte": {"svelte": "src/App.svelte", "css": "src/app.css"},
+}
+
+# Output type for projects with any number of files; never stopped early
+PROJECT_OUTPUT_TYPE = "Project"
+
+# Language names that may open a code block without being part of the code
+CODE_LANGUAGES = frozenset(
+    [
         "python",
         "html",
         "css",
@@ -764,64 +1508,135 @@ def remove_code_block(text):
         "sql-mariadb",
         "sql-sqlite",
         "sql-cassandra",
-        "sql-plSQL",
+        "sql-plsql",
         "sql-hive",
         "sql-pgsql",
         "sql-gql",
         "sql-gpsql",
         "sql-sparksql",
         "sql-esper",
-    ]:
-        return lines[1] if len(lines) > 1 else ""
-    return text.strip()
+    ]
+)
+
+# Lines that delimit fenced blocks (```lang) or file sections (=== name ===)
+_MARKER_LINE = re.compile(r"^(?:[ \t]*```([^\n]*)|===[^\n]*)$", re.MULTILINE)
+_SECTION_HEADER = re.compile(r"===\s*(\S+)\s*===")
+# Fallback for blocks whose fences are not on lines of their own
+_INLINE_BLOCK = re.compile(r"```([\s\S]+?)```")
+
+
+def _scan_response(text: str, nested: bool):
+    """One pass over the marker lines of ``text``; see split_response.
+
+    With ``nested``, a fence with a language inside an open block opens a
+    nested block (e.g. a bash example in a README) that the next bare fence
+    closes. Otherwise it closes the open block and starts the next one.
+    Also returns whether a block was left open after nested fences in it.
+    """
+    blocks: List[Tuple[str, str]] = []
+    sections: Dict[str, str] = {}
+    block_info = block_start = None
+    depth = 0  # nested blocks open inside the current block
+    had_nested = False
+    section_name = section_start = None
+    for marker in _MARKER_LINE.finditer(text):
+        info = marker.group(1)
+        if info is None:
+            # Only a full "=== name ===" line outside code blocks is a header
+            header = _SECTION_HEADER.fullmatch(marker.group(0).strip())
+            if block_info is not None or not header:
+                continue
+            if section_name and section_name not in sections:
+                sections[section_name] = text[section_start : marker.start()].strip()
+            section_name, section_start = header.group(1), marker.end() + 1
+            continue
+        info = info.strip()
+        if block_info is None:
+            block_info, block_start = info, marker.end() + 1
+            depth, had_nested = 0, False
+        elif info and nested:
+            depth += 1
+            had_nested = True
+        elif depth:
+            depth -= 1
+        else:
+            blocks.append((block_info, text[block_start : marker.start()].strip()))
+            block_info = info or None
+            block_start = marker.end() + 1
+    if section_name and section_name not in sections:
+        sections[section_name] = text[section_start:].strip()
+    return blocks, sections, block_info is not None and had_nested
+
+
+def split_response(text: str) -> Tuple[List[Tuple[str, str]], Dict[str, str]]:
+    """Split a model response into fenced blocks and ``=== name ===`` sections.
+
+    One linear pass over the marker lines. Returns the closed blocks as
+    (info string, content) pairs in order, and the section contents keyed by
+    file name in order of appearance (first occurrence wins). A section runs
+    to the next ``=== name ===`` line outside a code block. Fences with a
+    language inside a block open nested blocks; if that leaves a block
+    unclosed, the model most likely forgot a closing fence, and the text is
+    split again treating each fence with a language as the start of the
+    next block.
+    """
+    blocks, sections, unbalanced = _scan_response(text, nested=True)
+    if unbalanced:
+        blocks, sections, _ = _scan_response(text, nested=False)
+    return blocks, sections
+
+
+def _strip_language_line(code: str) -> str:
+    """Drop a leading line that only names the language, e.g. ``python``."""
+    first, _, rest = code.partition("\n")
+    return rest if first.strip().lower() in CODE_LANGUAGES else code
 
 
-def parse_transformers_js_output(text):
-    """Parse transformers.js output and extract the three files (index.html, index.js, style.css)"""
-    files = {"index.html": "", "index.js": "", "style.css": ""}
-
-    # Patterns to match the three code blocks
-    html_pattern = r"```html\s*\n([\s\S]+?)\n```"
-    js_pattern = r"```javascript\s*\n([\s\S]+?)\n```"
-    css_pattern = r"```css\s*\n([\s\S]+?)\n```"
-
-    # Extract HTML content
-    html_match = re.search(html_pattern, text, re.IGNORECASE)
-    if html_match:
-        files["index.html"] = html_match.group(1).strip()
-
-    # Extract JavaScript content
-    js_match = re.search(js_pattern, text, re.IGNORECASE)
-    if js_match:
-        files["index.js"] = js_match.group(1).strip()
-
-    # Extract CSS content
-    css_match = re.search(css_pattern, text, re.IGNORECASE)
-    if css_match:
-        files["style.css"] = css_match.group(1).strip()
-
-    # Fallback: support === index.html === format if any file is missing
-    if not (files["index.html"] and files["index.js"] and files["style.css"]):
-        # Use regex to extract sections
-        html_fallback = re.search(
-            r"===\s*index\.html\s*===\n([\s\S]+?)(?=\n===|$)", text, re.IGNORECASE
-        )
-        js_fallback = re.search(
-            r"===\s*index\.js\s*===\n([\s\S]+?)(?=\n===|$)", text, re.IGNORECASE
-        )
-        css_fallback = re.search(
-            r"===\s*style\.css\s*===\n([\s\S]+?)(?=\n===|$)", text, re.IGNORECASE
+def remove_code_block(text):
+    blocks, _ = split_response(text)
+    if blocks:
+        # Prefer an html block, then an unlabelled one, then the first block
+        _, code = next(
+            (block for block in blocks if block[0].lower() == "html"),
+            next((block for block in blocks if not block[0]), blocks[0]),
         )
-        if html_fallback:
-            files["index.html"] = html_fallback.group(1).strip()
-        if js_fallback:
-            files["index.js"] = js_fallback.group(1).strip()
-        if css_fallback:
-            files["style.css"] = css_fallback.group(1).strip()
-
+        return _strip_language_line(code)
+    match = _INLINE_BLOCK.search(text)
+    if match:
+        return _strip_language_line(match.group(1).strip())
+    stripped = text.strip()
+    # If no code block is found, check if the entire text is HTML
+    if stripped.startswith("<"):
+        return stripped
+    # Special handling for python: remove python marker
+    if stripped.startswith("```python"):
+        return stripped[9:-3].strip()
+    # Remove a leading language marker line if present (fallback)
+    return _strip_language_line(stripped)
+
+
+def _parse_files(text: str, block_files: Dict[str, str]) -> Dict[str, str]:
+    """Map the first block of each language in ``block_files`` to its file,
+    falling back to ``=== file ===`` sections if any file is missing."""
+    files = {name: "" for name in block_files.values()}
+    blocks, sections = split_response(text)
+    for info, code in blocks:
+        name = block_files.get(info.lower())
+        if name and not files[name]:
+            files[name] = code
+    if not all(files.values()):
+        sections = {name.lower(): content for name, content in sections.items()}
+        for name in files:
+            if sections.get(name.lower()):
+                files[name] = sections[name.lower()]
     return files
 
 
+def parse_transformers_js_output(text):
+    """Parse transformers.js output and extract the three files (index.html, index.js, style.css)"""
+    return _parse_files(text, CODE_BLOCK_FILES["Transformers.js"])
+
+
 def format_transformers_js_output(files):
     """Format the three files into a single display string"""
     output = []
@@ -836,38 +1651,7 @@ def format_transformers_js_output(files):
 
 def parse_svelte_output(text):
     """Parse Svelte output to extract individual files"""
-    files = {"src/App.svelte": "", "src/app.css": ""}
-
-    import re
-
-    # First try to extract using code block patterns
-    svelte_pattern = r"```svelte\s*\n([\s\S]+?)\n```"
-    css_pattern = r"```css\s*\n([\s\S]+?)\n```"
-
-    # Extract svelte block for App.svelte
-    svelte_match = re.search(svelte_pattern, text, re.IGNORECASE)
-    css_match = re.search(css_pattern, text, re.IGNORECASE)
-
-    if svelte_match:
-        files["src/App.svelte"] = svelte_match.group(1).strip()
-    if css_match:
-        files["src/app.css"] = css_match.group(1).strip()
-
-    # Fallback: support === filename === format if any file is missing
-    if not (files["src/App.svelte"] and files["src/app.css"]):
-        # Use regex to extract sections
-        app_svelte_fallback = re.search(
-            r"===\s*src/App\.svelte\s*===\n([\s\S]+?)(?=\n===|$)", text, re.IGNORECASE
-        )
-        if app_svelte_fallback:
-            files["src/App.svelte"] = app_svelte_fallback.group(1).strip()
-        app_css_fallback = re.search(
-            r"===\s*src/app\.css\s*===\n([\s\S]+?)(?=\n===|$)", text, re.IGNORECASE
-        )
-        if app_css_fallback:
-            files["src/app.css"] = app_css_fallback.group(1).strip()
-
-    return files
+    return _parse_files(text, CODE_BLOCK_FILES["Svelte"])
 
 
 def format_svelte_output(files: Dict[str, str]) -> str:
@@ -880,10 +1664,450 @@ def format_svelte_output(files: Dict[str, str]) -> str:
     return "\n".join(output)
 
 
+_FILENAME_ATTRIBUTE = re.compile(r"""(?:title|file|filename|path)=["']?([^\s"']+)""")
+_INFO_TOKEN_SEPARATOR = re.compile(r"[\s:]+")
+
+
+def block_filename(info: str) -> Optional[str]:
+    """File name given in a code block's info string, e.g. ``python app.py``,
+    ``js:src/app.js``, ``html title="index.html"`` or just ``index.html``."""
+    attribute = _FILENAME_ATTRIBUTE.search(info)
+    if attribute:
+        return attribute.group(1)
+    for token in _INFO_TOKEN_SEPARATOR.split(info):
+        if ("." in token or "/" in token) and token.lower() not in CODE_LANGUAGES:
+            return token
+    return None
+
+
+def _unwrap_fence(content: str) -> str:
+    """``content`` without the code block it starts with, if any. Only the
+    outer fence lines (and any text after the block) are removed, so fences
+    inside, e.g. examples in a README, are kept."""
+    if not content.startswith("```"):
+        return content
+    blocks, _ = split_response(content)
+    if blocks:
+        return blocks[0][1]
+    # Unclosed block, e.g. a truncated response
+    return content.partition("\n")[2].strip()
+
+
+def parse_project_output(text: str) -> Dict[str, str]:
+    """Parse a multi-file response into {path: content} in order of appearance.
+
+    Files come from ``=== path ===`` sections, with a code block wrapping the
+    section unwrapped, and from code blocks whose info string names a file.
+    """
+    blocks, sections = split_response(text)
+    files = {path: _unwrap_fence(content) for path, content in sections.items()}
+    for info, code in blocks:
+        path = block_filename(info)
+        if path and path not in files:
+            files[path] = code
+    return files
+
+
+def format_project_output(files: Dict[str, str]) -> str:
+    """Format project files into one string that parse_project_output reads back"""
+    return "\n\n".join(f"=== {path} ===\n{content}" for path, content in files.items())
+
+
+# gr.Code language for project files, by extension
+CODE_LANGUAGE_BY_EXTENSION = {
+    ".py": "python",
+    ".js": "javascript",
+    ".jsx": "javascript",
+    ".mjs": "javascript",
+    ".ts": "typescript",
+    ".tsx": "typescript",
+    ".html": "html",
+    ".svelte": "html",
+    ".vue": "html",
+    ".css": "css",
+    ".json": "json",
+    ".md": "markdown",
+    ".yaml": "yaml",
+    ".yml": "yaml",
+    ".sh": "shell",
+    ".sql": "sql",
+    ".c": "c",
+    ".h": "c",
+    ".cpp": "cpp",
+    ".r": "r",
+}
+
+
+def safe_relative_path(name: str) -> Optional[str]:
+    """Normalize a generated file name to a relative POSIX path that stays
+    inside its root, or None if it cannot."""
+    path = posixpath.normpath(name.replace("\\", "/")).lstrip("/")
+    if path in ("", ".") or path.startswith(".."):
+        return None
+    return path
+
+
+# Project archives, one per UI session; Gradio serves a copy from its cache
+PROJECT_ZIP_DIR = os.path.join(tempfile.gettempdir(), "ollama-coder-projects")
+
+
+def project_zip_path(session: Optional[str]) -> str:
+    key = hashlib.sha256((session or "default").encode("utf-8")).hexdigest()[:16]
+    return os.path.join(PROJECT_ZIP_DIR, key, "project.zip")
+
+
+def write_project_zip(
+    files: Dict[str, str], session: Optional[str] = None
+) -> Optional[str]:
+    """Write ``files`` to the session's zip archive and return its path. The
+    archive is replaced on every call. Entries go straight to disk one file
+    at a time."""
+    if not files:
+        return None
+    path = project_zip_path(session)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    partial = f"{path}.partial"
+    with zipfile.ZipFile(partial, "w", zipfile.ZIP_DEFLATED) as archive:
+        for name, content in files.items():
+            entry = safe_relative_path(name)
+            if entry:
+                archive.writestr(entry, content)
+    os.replace(partial, path)
+    return path
+
+
+def remove_project_zip(session: Optional[str]):
+    """Delete the session's project archive, if any."""
+    path = project_zip_path(session)
+    try:
+        os.remove(path)
+        os.rmdir(os.path.dirname(path))
+    except OSError:
+        pass
+
+
+# Stop sequences for single-block output types: a blank line after the closing
+# fence starts the explanation that remove_code_block throws away
+OUTPUT_STOP_SEQUENCES = {
+    "HTML": ["\n```\n\n"],
+    "Python": ["\n```\n\n"],
+    "JavaScript": ["\n```\n\n"],
+}
+
+
+class CodeBlockTracker:
+    """Follows a streamed response line by line and reports when the code
+    blocks expected for the output type are complete."""
+
+    def __init__(self, output_type: str):
+        self.expected = set(CODE_BLOCK_FILES.get(output_type, ()))
+        self.open_ended = output_type == PROJECT_OUTPUT_TYPE
+        # Unfenced HTML is complete at </html>
+        self.raw_html = output_type == "HTML"
+        self.fence: Optional[str] = None  # info string of the open block
+        self.depth = 0  # nested blocks open inside it, as in split_response
+        self.closed: List[str] = []
+        self._partial = ""
+
+    def feed(self, delta: str) -> bool:
+        """Consume a streamed chunk; True once the expected code is complete."""
+        lines = (self._partial + delta).split("\n")
+        self._partial = lines.pop()
+        return any(self._feed_line(line) for line in lines)
+
+    def _feed_line(self, line: str) -> bool:
+        marker = line.strip()
+        if self.fence is None:
+            if marker.startswith("```"):
+                self.fence = marker[3:].strip()
+                return False
+            return self.raw_html and not self.closed and "</html>" in marker.lower()
+        if marker.startswith("```") and marker != "```":
+            self.depth += 1
+            return False
+        if marker != "```":
+            return False
+        if self.depth:
+            self.depth -= 1
+            return False
+        self.closed.append(self.fence.lower())
+        self.fence = None
+        return not self.open_ended and self.expected.issubset(self.closed)
+
+    def closing_text(self) -> str:
+        """Fences that close a response which ended inside a code block, e.g.
+        because a stop sequence cut it, or "" if none are needed."""
+        if self.fence is None:
+            return ""
+        fences = self.depth + 1
+        if self._partial.strip() == "```":
+            fences -= 1
+        if not fences:
+            return ""
+        return ("\n" if self._partial else "") + "\n".join(["```"] * fences)
+
+
+class CodeStreamExtractor(CodeBlockTracker):
+    """Incremental version of process_code_output for streamed responses.
+
+    Each delta is split into lines that are appended to the file being
+    written, either a fenced block or an ``=== filename ===`` section, so
+    parsing costs O(delta) per update instead of re-running the regexes on
+    the whole buffer. As with the full parsers, the first block for a file
+    wins. Project output starts with no files and adds one for every section
+    header or code block that names a file. Each file's text is extended
+    only by its new lines, and files() and code() are cached until the next
+    delta, so rendering a frame doesn't re-join the whole buffer.
+    """
+
+    def __init__(self, output_type: str):
+        super().__init__(output_type)
+        self.output_type = output_type
+        self.block_files = CODE_BLOCK_FILES.get(output_type, {})
+        names = [] if self.open_ended else list(self.block_files.values()) or ["code"]
+        self.contents: Dict[str, List[str]] = {name: [] for name in names}
+        self._names = {name.lower(): name for name in names}
+        self.complete = set()
+        self.section: Optional[str] = None  # current === filename === section
+        self.current: Optional[str] = None  # file receiving lines
+        # Joined text of each file and how many of its lines it holds
+        self._text: Dict[str, str] = {}
+        self._joined: Dict[str, int] = {}
+        self._cache: Dict[str, object] = {}
+
+    def feed(self, delta: str) -> bool:
+        if delta:
+            self._cache.clear()
+        return super().feed(delta)
+
+    def _file_for_block(self, info: str) -> Optional[str]:
+        if self.open_ended:
+            name = block_filename(info) or self.section
+            if name:
+                self.contents.setdefault(name, [])
+        elif self.block_files:
+            name = self.block_files.get(info.lower()) or self.section
+        else:
+            name = "code"
+        return None if name in self.complete else name
+
+    def _section_for(self, line: str) -> Optional[str]:
+        header = _SECTION_HEADER.fullmatch(line.strip())
+        if not header:
+            return None
+        if self.open_ended:
+            self.contents.setdefault(header.group(1), [])
+            return header.group(1)
+        return self._names.get(header.group(1).lower())
+
+    def _feed_line(self, line: str) -> bool:
+        opened = self.fence
+        done = super()._feed_line(line)
+        if opened is None and self.fence is not None:
+            self.current = self._file_for_block(self.fence)
+        elif opened is not None and self.fence is None:
+            if self.current:
+                self.complete.add(self.current)
+            self.current = None
+        elif self.fence is None:
+            # Outside code blocks: === filename === sections and raw HTML
+            header = self._section_for(line)
+            if header:
+                self.section = self.current = header
+            elif (
+                self.raw_html
+                and self.current is None
+                and not self.closed
+                and line.strip().startswith("<")
+            ):
+                self.current = "code"
+            if self.current and self.current not in self.complete and not header:
+                self.contents[self.current].append(line)
+        elif self.current:
+            self.contents[self.current].append(line)
+        return done
+
+    def file_text(self, name: str) -> str:
+        """Contents of ``name`` so far, including the line being written."""
+        lines = self.contents[name]
+        joined = self._joined.get(name, 0)
+        if joined < len(lines):
+            new = "\n".join(lines[joined:])
+            self._text[name] = f"{self._text[name]}\n{new}" if joined else new
+            self._joined[name] = len(lines)
+        text = self._text.get(name, "")
+        partial = self._partial
+        if name == self.current and partial and not partial.lstrip().startswith("`"):
+            text = f"{text}\n{partial}" if text else partial
+        return text.strip()
+
+    def files(self) -> Dict[str, str]:
+        """Contents of every file found so far."""
+        if "files" not in self._cache:
+            self._cache["files"] = {
+                name: self.file_text(name) for name in self.contents
+            }
+        return dict(self._cache["files"])
+
+    def code(self) -> str:
+        """Code so far, formatted like process_code_output."""
+        if "code" not in self._cache:
+            if self.open_ended:
+                code = format_project_output(self.files())
+            elif not self.block_files:
+                code = self.file_text("code")
+            elif self.output_type == "Transformers.js":
+                code = format_transformers_js_output(self.files())
+            else:
+                code = format_svelte_output(self.files())
+            self._cache["code"] = code
+        return self._cache["code"]
+
+
+# File names the model writes before a SEARCH/REPLACE block ("... in style.css")
+_PATCH_FILE_NAME = re.compile(r"[\w./-]+\.(?:html|js|css)\b")
+
+
+def parse_search_replace_blocks(text: str) -> List[Tuple[Optional[str], str, str]]:
+    """Extract (file, search, replace) from SEARCH/REPLACE blocks in one pass.
+
+    ``file`` is the last file name mentioned outside a block before it (or
+    None); multi-file follow-up prompts ask the model to name the file first.
+    """
+    blocks = []
+    state = None
+    file_name = None
+    search_lines: List[str] = []
+    replace_lines: List[str] = []
+    for line in text.splitlines():
+        marker = line.strip()
+        if marker == SEARCH_START:
+            state, search_lines, replace_lines = "search", [], []
+        elif marker == DIVIDER and state == "search":
+            state = "replace"
+        elif marker == REPLACE_END and state == "replace":
+            blocks.append(
+                (file_name, "\n".join(search_lines), "\n".join(replace_lines))
+            )
+            state = None
+        elif state == "search":
+            search_lines.append(line)
+        elif state == "replace":
+            replace_lines.append(line)
+        else:
+            names = _PATCH_FILE_NAME.findall(line)
+            if names:
+                file_name = posixpath.basename(names[-1])
+    return blocks
+
+
+def _find_lines_loose(code_lines: List[str], search_lines: List[str]) -> Optional[int]:
+    """Index of the first run of code lines matching search_lines when leading
+    and trailing whitespace on each line is ignored."""
+    target = [line.strip() for line in search_lines]
+    stripped = [line.strip() for line in code_lines]
+    for i in range(len(stripped) - len(target) + 1):
+        if stripped[i] == target[0] and stripped[i : i + len(target)] == target:
+            return i
+    return None
+
+
+def _apply_block(code: str, search: str, replace: str) -> Optional[str]:
+    """Apply one SEARCH/REPLACE block to ``code``, or return None if the
+    search text is not found."""
+    if not search.strip():
+        # Empty SEARCH block: insert at the very beginning
+        return f"{replace}\n{code}" if replace else code
+    # An exact match at the start of a line is taken as is
+    first = index = code.find(search)
+    while index > 0 and code[index - 1] != "\n":
+        index = code.find(search, index + 1)
+    if index != -1:
+        return code[:index] + replace + code[index + len(search) :]
+    # Then whole lines ignoring indentation, so a SEARCH with the wrong
+    # indentation replaces the lines rather than text inside them
+    code_lines = code.split("\n")
+    search_lines = search.strip("\n").split("\n")
+    start = _find_lines_loose(code_lines, search_lines)
+    if start is not None:
+        code_lines[start : start + len(search_lines)] = (
+            replace.split("\n") if replace else []
+        )
+        return "\n".join(code_lines)
+    # Finally a fragment in the middle of a line
+    if first != -1:
+        return code[:first] + replace + code[first + len(search) :]
+    return None
+
+
+def apply_search_replace(
+    code: str, response: str, output_type: str = "HTML"
+) -> Optional[str]:
+    """Apply the SEARCH/REPLACE blocks in ``response`` to ``code``.
+
+    Each block is matched exactly first, then line by line ignoring
+    indentation and trailing whitespace. For Transformers.js, ``code`` is
+    split into its files and each block patches the file named before it
+    (or the first file it matches). Returns the patched code, or None if the
+    response has no blocks or any block does not match.
+    """
+    blocks = parse_search_replace_blocks(response)
+    if not blocks:
+        return None
+    if output_type != "Transformers.js":
+        for _, search, replace in blocks:
+            code = _apply_block(code, search, replace)
+            if code is None:
+                return None
+        return code
+
+    files = parse_transformers_js_output(code)
+    for file_name, search, replace in blocks:
+        targets = [file_name] if file_name in files else list(files)
+        for target in targets:
+            patched = _apply_block(files[target], search, replace)
+            if patched is not None:
+                files[target] = patched
+                break
+        else:
+            return None
+    return format_transformers_js_output(files)
+
+
+def code_as_response(code: str, output_type: str) -> str:
+    """``code`` written the way a full (non-diff) response would contain it."""
+    if output_type == "HTML":
+        return f"```html\n{code}\n```"
+    return code
+
+
+def code_from_full_reply(response: str, output_type: str) -> Optional[str]:
+    """Code of a follow-up reply that rewrote the whole file (or, for
+    Transformers.js, all three files) instead of sending SEARCH/REPLACE
+    blocks, as small models often do. None if it has no complete code."""
+    if parse_search_replace_blocks(response):
+        return None
+    blocks, _ = split_response(response)
+    if not blocks:
+        return None
+    if output_type == "Transformers.js" and not all(
+        parse_transformers_js_output(response).values()
+    ):
+        return None
+    return process_code_output(response, output_type)
+
+
+def last_turn_has_code(history: History, code: str, output_type: str) -> bool:
+    """True if the last assistant turn of ``history`` already holds ``code``,
+    so the model has it without sending it again."""
+    return bool(history) and process_code_output(history[-1][1], output_type) == code
+
+
 def perform_web_search(query: str) -> Optional[str]:
     """Perform web search using Tavily (if available) and return formatted results."""
     if not tavily_client:
         return None
+    started = time.perf_counter()
     try:
         results = tavily_client.search(query, max_results=5)
         formatted_results = []
@@ -895,75 +2119,1529 @@ def perform_web_search(query: str) -> Optional[str]:
     except Exception as e:
         print(f"Search error: {e}")
         return None
+    finally:
+        METRICS.observe(
+            "ollama_coder_web_search_seconds", time.perf_counter() - started
+        )
 
 
-def chat_with_model(
+def _response_field(obj, key: str, default=None):
+    """Read a field from an Ollama response that may be a dict or a response model."""
+    if obj is None:
+        return default
+    getter = getattr(obj, "get", None)
+    if callable(getter):
+        value = getter(key, default)
+    else:
+        value = getattr(obj, key, default)
+    return default if value is None else value
+
+
+def _response_text(response) -> str:
+    """Extract the assistant text from a (possibly partial) chat response."""
+    if isinstance(response, str):
+        return response
+    message = _response_field(response, "message")
+    return (
+        _response_field(message, "content")
+        or _response_field(response, "output")
+        or _response_field(response, "text")
+        or ""
+    )
+
+
+async def _iter_chunks(response):
+    """Iterate a streamed chat response, or a single non-streamed response."""
+    if STREAM_RESPONSES:
+        async for chunk in response:
+            yield chunk
+    else:
+        yield response
+
+
+# Upper bounds (seconds) of the latency histogram buckets
+METRICS_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+
+class Metrics:
+    """Counters and histograms rendered in the Prometheus text format.
+
+    Metrics are declared once with describe() and updated from any thread.
+    Values that already live elsewhere (cache stats, queue depth) are read
+    when /metrics is scraped; see metrics_text().
+    """
+
+    def __init__(self, buckets: Tuple[float, ...] = METRICS_BUCKETS):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._meta: Dict[str, Tuple[str, str]] = {}
+        self._values: Dict[str, Dict[Tuple, object]] = {}
+
+    def describe(self, name: str, kind: str, help_text: str):
+        self._meta[name] = (kind, help_text)
+        self._values.setdefault(name, {})
+
+    def inc(self, name: str, labels: Optional[Dict] = None, value: float = 1):
+        key = tuple(sorted((labels or {}).items()))
+        with self._lock:
+            series = self._values[name]
+            series[key] = series.get(key, 0) + value
+
+    def observe(self, name: str, seconds: float, labels: Optional[Dict] = None):
+        key = tuple(sorted((labels or {}).items()))
+        with self._lock:
+            series = self._values[name]
+            # Per-bucket counts, then sum and count
+            histogram = series.setdefault(key, [0] * (len(self.buckets) + 2))
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    histogram[i] += 1
+            histogram[-2] += seconds
+            histogram[-1] += 1
+
+    def render(self, gauges: List[Tuple[str, str, str, Dict, float]] = ()) -> str:
+        """Text exposition of every metric, plus ``gauges`` given as
+        (name, kind, help, labels, value) read at scrape time."""
+        lines = []
+        with self._lock:
+            snapshot = {
+                name: {
+                    k: list(v) if isinstance(v, list) else v for k, v in series.items()
+                }
+                for name, series in self._values.items()
+            }
+        for name, series in snapshot.items():
+            kind, help_text = self._meta[name]
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for key, value in series.items():
+                labels = dict(key)
+                if kind != "histogram":
+                    lines.append(f"{name}{_metric_labels(labels)} {value:g}")
+                    continue
+                for bound, count in zip(self.buckets, value):
+                    bucket_labels = _metric_labels({**labels, "le": f"{bound:g}"})
+                    lines.append(f"{name}_bucket{bucket_labels} {count}")
+                inf_labels = _metric_labels({**labels, "le": "+Inf"})
+                lines.append(f"{name}_bucket{inf_labels} {value[-1]}")
+                lines.append(f"{name}_sum{_metric_labels(labels)} {value[-2]:g}")
+                lines.append(f"{name}_count{_metric_labels(labels)} {value[-1]}")
+        described = set()
+        for name, kind, help_text, labels, value in gauges:
+            if name not in described:
+                described.add(name)
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {kind}")
+            lines.append(f"{name}{_metric_labels(labels)} {value:g}")
+        return "\n".join(lines) + "\n"
+
+
+def _metric_labels(labels: Dict) -> str:
+    if not labels:
+        return ""
+    pairs = []
+    for key, value in sorted(labels.items()):
+        value = (
+            str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        )
+        pairs.append(f'{key}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+METRICS = Metrics()
+METRICS.describe(
+    "ollama_coder_requests_total",
+    "counter",
+    "Chat generations by model and outcome (ok, error, cancelled, cached).",
+)
+METRICS.describe(
+    "ollama_coder_queue_wait_seconds",
+    "histogram",
+    "Time spent waiting for a per-model admission slot.",
+)
+METRICS.describe(
+    "ollama_coder_prompt_eval_seconds",
+    "histogram",
+    "Prompt evaluation time reported by Ollama.",
+)
+METRICS.describe(
+    "ollama_coder_decode_seconds", "histogram", "Decode time reported by Ollama."
+)
+METRICS.describe(
+    "ollama_coder_postprocess_seconds",
+    "histogram",
+    "Time spent turning a response into code, by output type.",
+)
+METRICS.describe(
+    "ollama_coder_prompt_tokens_total",
+    "counter",
+    "Prompt tokens evaluated by Ollama (prompt_eval_count).",
+)
+METRICS.describe(
+    "ollama_coder_output_tokens_total",
+    "counter",
+    "Tokens generated by Ollama (eval_count).",
+)
+METRICS.describe(
+    "ollama_coder_early_stops_total",
+    "counter",
+    "Generations stopped once their code was complete.",
+)
+METRICS.describe(
+    "ollama_coder_web_search_seconds", "histogram", "Duration of Tavily web searches."
+)
+METRICS.describe(
+    "ollama_coder_ocr_seconds", "histogram", "Duration of OCR text extraction."
+)
+
+
+# Recent per-generation stats reported by Ollama, newest last
+GENERATION_STATS: "deque[Dict]" = deque(maxlen=1000)
+
+
+def record_generation_stats(
+    model_id: str, host: str, message_count: int, final_chunk
+) -> Optional[Dict]:
+    """Store (and log) the timing stats from the final chunk of a generation.
+
+    A flat ``prompt_eval_ms`` as ``messages`` grows shows the prompt prefix is
+    being served from Ollama's KV cache.
+    """
+    if final_chunk is None:
+        return None
+    return _record_stats(
+        {
+            "time": time.time(),
+            "model": model_id,
+            "host": host,
+            "messages": message_count,
+            "prompt_eval_count": _response_field(final_chunk, "prompt_eval_count", 0),
+            "prompt_eval_ms": _response_field(final_chunk, "prompt_eval_duration", 0)
+            / 1e6,
+            "eval_count": _response_field(final_chunk, "eval_count", 0),
+            "eval_ms": _response_field(final_chunk, "eval_duration", 0) / 1e6,
+            "load_ms": _response_field(final_chunk, "load_duration", 0) / 1e6,
+            "estimated": False,
+        }
+    )
+
+
+def record_estimated_stats(
+    model_id: str,
+    host: str,
+    message_count: int,
+    prompt_tokens: int,
+    output_tokens: int,
+    prompt_seconds: float,
+    decode_seconds: float,
+) -> Dict:
+    """Store (and log) estimated stats for a generation stopped early, which
+    never gets Ollama's final chunk.
+
+    Token counts come from TOKEN_ESTIMATOR and the durations are wall-clock
+    time to the first token and after it; the entry is flagged ``estimated``.
+    """
+    return _record_stats(
+        {
+            "time": time.time(),
+            "model": model_id,
+            "host": host,
+            "messages": message_count,
+            "prompt_eval_count": prompt_tokens,
+            "prompt_eval_ms": prompt_seconds * 1000,
+            "eval_count": output_tokens,
+            "eval_ms": decode_seconds * 1000,
+            "load_ms": 0.0,
+            "estimated": True,
+        }
+    )
+
+
+def _record_stats(stats: Dict) -> Dict:
+    model_id, host = stats["model"], stats["host"]
+    GENERATION_STATS.append(stats)
+    labels = {"model": model_id}
+    METRICS.observe(
+        "ollama_coder_prompt_eval_seconds", stats["prompt_eval_ms"] / 1000, labels
+    )
+    METRICS.observe("ollama_coder_decode_seconds", stats["eval_ms"] / 1000, labels)
+    METRICS.inc("ollama_coder_prompt_tokens_total", labels, stats["prompt_eval_count"])
+    METRICS.inc("ollama_coder_output_tokens_total", labels, stats["eval_count"])
+    if LOG_GENERATION_STATS:
+        print(
+            f"📊 {model_id} @ {host}: {stats['messages']} messages, "
+            f"prompt {stats['prompt_eval_count']} tokens in {stats['prompt_eval_ms']:.0f}ms, "
+            f"output {stats['eval_count']} tokens in {stats['eval_ms']:.0f}ms"
+            + (" (estimated)" if stats["estimated"] else "")
+        )
+    return stats
+
+
+def estimate_tokens_saved(model_id: str, generated_tokens: int) -> int:
+    """Tokens a cancelled generation would still have produced, estimated from
+    the average output length of recent completed generations of the model."""
+    counts = [s["eval_count"] for s in GENERATION_STATS if s["model"] == model_id]
+    if not counts:
+        return 0
+    return max(0, round(sum(counts) / len(counts)) - generated_tokens)
+
+
+def drop_turn(history: History, turn: list):
+    """Remove ``turn`` (by identity) from ``history`` if it is still there."""
+    for i, existing in enumerate(history):
+        if existing is turn:
+            del history[i]
+            return
+
+
+class GenerationRegistry:
+    """In-flight generations by UI session, so a session's generations can be
+    cancelled when it clears the chat, sends a new message or disconnects.
+
+    Generations are ENGINE_LOOP tasks; cancelling one closes its streaming
+    HTTP response so Ollama stops decoding. Thread-safe.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._active: Dict[str, set] = {}
+        self._turns: Dict[asyncio.Task, Tuple[History, list]] = {}
+        self.stats = {"cancelled": 0, "tokens_saved": 0}
+
+    def register(self, session: str, task: asyncio.Task, history: History):
+        """Track ``task``, which is generating the last turn of ``history``."""
+        with self._lock:
+            self._active.setdefault(session, set()).add(task)
+            self._turns[task] = (history, history[-1])
+
+    def unregister(self, session: str, task: asyncio.Task):
+        with self._lock:
+            self._turns.pop(task, None)
+            tasks = self._active.get(session)
+            if tasks is not None:
+                tasks.discard(task)
+                if not tasks:
+                    del self._active[session]
+
+    def active_counts(self) -> Tuple[int, int]:
+        """(sessions, generations) currently in flight."""
+        with self._lock:
+            return len(self._active), sum(len(t) for t in self._active.values())
+
+    def cancel(self, session: Optional[str]) -> int:
+        """Cancel every in-flight generation of ``session``; returns how many.
+
+        The partial turns are removed from their history right away, so a
+        message sent next never includes a cut-off answer.
+        """
+        with self._lock:
+            tasks = list(self._active.pop(session, ())) if session else []
+            turns = [self._turns.pop(task) for task in tasks if task in self._turns]
+        for history, turn in turns:
+            drop_turn(history, turn)
+        for task in tasks:
+            ENGINE_LOOP.loop.call_soon_threadsafe(task.cancel)
+        return len(tasks)
+
+    def record_cancelled(self, model_id: str, generated_tokens: int):
+        saved = estimate_tokens_saved(model_id, generated_tokens)
+        with self._lock:
+            self.stats["cancelled"] += 1
+            self.stats["tokens_saved"] += saved
+        print(
+            f"🛑 Cancelled {model_id} generation after {generated_tokens} tokens "
+            f"(~{saved} tokens saved)"
+        )
+
+
+GENERATIONS = GenerationRegistry()
+
+
+async def _astream_ollama(
+    model_id: str,
+    messages: Messages,
+    options: Dict,
+    priority: int = 0,
+    early_stop: Optional[Dict] = None,
+):
+    """Run one chat request through admission control and host routing.
+
+    Yields ("queued", position) while waiting for a slot, ("delta", text) for
+    each generated chunk and finally ("done", last_chunk). Errors are raised.
+    If the stream is closed after the caller set ``output_tokens`` in
+    ``early_stop`` (a dict also holding ``prompt_tokens``), estimated stats
+    are recorded in place of Ollama's.
+    """
+    queued_at = time.perf_counter()
+    async for position in ADMISSION.wait_for_slot(model_id, priority):
+        yield "queued", position
+    METRICS.observe(
+        "ollama_coder_queue_wait_seconds",
+        time.perf_counter() - queued_at,
+        {"model": model_id},
+    )
+    try:
+        manager = OLLAMA_ROUTER.select(model_id)
+        client = manager.get_async_client() if manager else None
+        if not client:
+            raise ConnectionError("Ollama is not running. Please start Ollama first.")
+
+        OLLAMA_ROUTER.acquire(manager, model_id)
+        try:
+            started = time.perf_counter()
+            first_token_at = None
+            response = await client.chat(
+                model=model_id,
+                messages=messages,
+                options=options,
+                stream=STREAM_RESPONSES,
+                keep_alive=get_keep_alive(model_id),
+            )
+            last_chunk = None
+            generated_chars = 0
+            try:
+                async for chunk in _iter_chunks(response):
+                    last_chunk = chunk
+                    delta = _response_text(chunk)
+                    if delta:
+                        if first_token_at is None:
+                            first_token_at = time.perf_counter()
+                        generated_chars += len(delta)
+                        yield "delta", delta
+            except (GeneratorExit, asyncio.CancelledError):
+                # Stopped early: Ollama's final chunk with its stats never comes
+                if early_stop and early_stop.get("output_tokens") is not None:
+                    record_estimated_stats(
+                        model_id,
+                        manager.host,
+                        len(messages),
+                        early_stop["prompt_tokens"],
+                        early_stop["output_tokens"],
+                        first_token_at - started,
+                        time.perf_counter() - first_token_at,
+                    )
+                raise
+            finally:
+                # Closing the HTTP response makes Ollama stop decoding
+                if hasattr(response, "aclose"):
+                    await response.aclose()
+            stats = record_generation_stats(
+                model_id, manager.host, len(messages), last_chunk
+            )
+            if stats:
+                TOKEN_ESTIMATOR.calibrate(
+                    model_id, generated_chars, stats["eval_count"]
+                )
+            yield "done", last_chunk
+        except (ConnectionError, httpx.TransportError) as e:
+            manager.report_failure(e)
+            raise
+        finally:
+            OLLAMA_ROUTER.release(manager)
+    finally:
+        ADMISSION.release(model_id)
+
+
+def request_key(model_id: str, messages: Messages, options: Dict) -> str:
+    """Stable hash identifying a chat request by model, messages and options."""
+    payload = json.dumps(
+        [model_id, messages, options], sort_keys=True, ensure_ascii=False, default=str
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class _Flight:
+    """One in-flight generation and the events it has produced so far."""
+
+    def __init__(self):
+        self.events: List[Tuple[str, object]] = []
+        self.error: Optional[Exception] = None
+        self.done = False
+        self.subscribers = 0
+        self.task: Optional[asyncio.Task] = None
+        self.updated = asyncio.get_running_loop().create_future()
+
+    def notify(self):
+        self.updated.set_result(None)
+        self.updated = asyncio.get_running_loop().create_future()
+
+
+class SingleFlight:
+    """Coalesce identical concurrent requests into one generation.
+
+    Lives on ENGINE_LOOP. The first caller starts the generation; later callers
+    with the same key replay the events produced so far and then follow the
+    live stream. The generation is cancelled once every caller has gone.
+    """
+
+    def __init__(self):
+        self._flights: Dict[str, _Flight] = {}
+        self.coalesced = 0
+
+    async def _run(self, key: str, flight: _Flight, agen):
+        try:
+            async for event in agen:
+                flight.events.append(event)
+                flight.notify()
+        except Exception as e:
+            flight.error = e
+        finally:
+            flight.done = True
+            flight.notify()
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+
+    async def stream(self, key: str, start):
+        """Yield the events of the generation for ``key``, calling ``start()``
+        to create it if none is running."""
+        flight = self._flights.get(key)
+        if flight is None:
+            flight = _Flight()
+            self._flights[key] = flight
+            flight.task = asyncio.ensure_future(self._run(key, flight, start()))
+        else:
+            self.coalesced += 1
+
+        flight.subscribers += 1
+        index = 0
+        try:
+            while True:
+                while index < len(flight.events):
+                    yield flight.events[index]
+                    index += 1
+                if flight.done:
+                    if flight.error:
+                        raise flight.error
+                    return
+                # Shield so a cancelled subscriber doesn't cancel the shared future
+                await asyncio.shield(flight.updated)
+        finally:
+            flight.subscribers -= 1
+            if flight.subscribers == 0 and not flight.done:
+                flight.task.cancel()
+
+
+SINGLE_FLIGHT = SingleFlight()
+
+
+class ResponseCache:
+    """Content-addressed cache of generated responses.
+
+    A size-bounded in-memory LRU sits in front of a size-bounded SQLite table;
+    both evict least recently used entries first. Thread-safe.
+    """
+
+    def __init__(self, path: Optional[str], memory_bytes: int, disk_bytes: int):
+        self.memory_limit = memory_bytes
+        self.disk_limit = disk_bytes
+        self._memory: "OrderedDict[str, str]" = OrderedDict()
+        self._memory_bytes = 0
+        self._disk_bytes = 0
+        self._lock = threading.Lock()
+        self.stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "evictions": 0}
+        self._db = None
+        if path:
+            try:
+                os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+                self._db = sqlite3.connect(path, check_same_thread=False)
+                self._db.execute(
+                    "CREATE TABLE IF NOT EXISTS responses ("
+                    "key TEXT PRIMARY KEY, value TEXT NOT NULL, "
+                    "size INTEGER NOT NULL, accessed REAL NOT NULL)"
+                )
+                self._db.execute(
+                    "CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)"
+                )
+                self._db.commit()
+                self._disk_bytes = self._db.execute(
+                    "SELECT COALESCE(SUM(size), 0) FROM responses"
+                ).fetchone()[0]
+            except Exception as e:
+                print(f"Response cache disk tier disabled: {e}")
+                self._db = None
+
+    def _remember(self, key: str, value: str):
+        size = len(value.encode("utf-8"))
+        if size > self.memory_limit:
+            return
+        old = self._memory.pop(key, None)
+        if old is not None:
+            self._memory_bytes -= len(old.encode("utf-8"))
+        self._memory[key] = value
+        self._memory_bytes += size
+        while self._memory_bytes > self.memory_limit:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_bytes -= len(evicted.encode("utf-8"))
+            self.stats["evictions"] += 1
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            value = self._memory.get(key)
+            if value is not None:
+                self._memory.move_to_end(key)
+                self.stats["memory_hits"] += 1
+                return value
+            if self._db is not None:
+                row = self._db.execute(
+                    "SELECT value FROM responses WHERE key = ?", (key,)
+                ).fetchone()
+                if row:
+                    self._db.execute(
+                        "UPDATE responses SET accessed = ? WHERE key = ?",
+                        (time.time(), key),
+                    )
+                    self._db.commit()
+                    self._remember(key, row[0])
+                    self.stats["disk_hits"] += 1
+                    return row[0]
+            self.stats["misses"] += 1
+            return None
+
+    def put(self, key: str, value: str):
+        with self._lock:
+            self._remember(key, value)
+            if self._db is None:
+                return
+            size = len(value.encode("utf-8"))
+            if size > self.disk_limit:
+                return
+            old = self._db.execute(
+                "SELECT size FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            self._db.execute(
+                "INSERT OR REPLACE INTO responses (key, value, size, accessed) "
+                "VALUES (?, ?, ?, ?)",
+                (key, value, size, time.time()),
+            )
+            self._disk_bytes += size - (old[0] if old else 0)
+            while self._disk_bytes > self.disk_limit:
+                oldest = self._db.execute(
+                    "SELECT key, size FROM responses ORDER BY accessed LIMIT 64"
+                ).fetchall()
+                if not oldest:
+                    break
+                self._db.executemany(
+                    "DELETE FROM responses WHERE key = ?", [(k,) for k, _ in oldest]
+                )
+                self._disk_bytes -= sum(size for _, size in oldest)
+                self.stats["evictions"] += len(oldest)
+            self._db.commit()
+
+    def hit_ratio(self) -> float:
+        hits = self.stats["memory_hits"] + self.stats["disk_hits"]
+        total = hits + self.stats["misses"]
+        return hits / total if total else 0.0
+
+
+RESPONSE_CACHE = (
+    ResponseCache(
+        RESPONSE_CACHE_PATH,
+        int(RESPONSE_CACHE_MEMORY_MB * 1024 * 1024),
+        int(RESPONSE_CACHE_DISK_MB * 1024 * 1024),
+    )
+    if RESPONSE_CACHE_ENABLED
+    else None
+)
+
+
+def is_deterministic(options: Dict) -> bool:
+    """True if the same request always yields the same output."""
+    return options.get("temperature") == 0 or options.get("seed") is not None
+
+
+class SemanticCache:
+    """Cache of generated responses looked up by prompt embedding similarity.
+
+    Entries live in one vector index per namespace (model + system prompt, i.e.
+    per output type). Each namespace holds at most ``max_entries`` entries and
+    evicts the least recently used one. Lives on ENGINE_LOOP.
+    """
+
+    def __init__(self, threshold: float, max_entries: int):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        # namespace -> {"vectors": matrix, "responses": [...], "used": [...]}
+        self._indexes: Dict[str, Dict] = {}
+        self._encoder = None
+        self._error_reported = False
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+    async def embed(self, text: str):
+        """Return a unit-length embedding for ``text``, or None on failure."""
+        try:
+            if SEMANTIC_CACHE_OLLAMA_MODEL:
+                manager = OLLAMA_ROUTER.select(SEMANTIC_CACHE_OLLAMA_MODEL)
+                client = manager.get_async_client() if manager else None
+                if not client:
+                    return None
+                response = await client.embed(
+                    model=SEMANTIC_CACHE_OLLAMA_MODEL, input=text
+                )
+                vector = np.asarray(
+                    _response_field(response, "embeddings")[0], dtype=np.float32
+                )
+            else:
+                if self._encoder is None:
+                    from sentence_transformers import SentenceTransformer
+
+                    self._encoder = await asyncio.to_thread(
+                        SentenceTransformer, EMBEDDING_MODEL
+                    )
+                vector = await asyncio.to_thread(
+                    self._encoder.encode, text, convert_to_numpy=True
+                )
+                vector = np.asarray(vector, dtype=np.float32)
+        except Exception as e:
+            if not self._error_reported:
+                print(f"Semantic cache embedding error: {e}")
+                self._error_reported = True
+            return None
+        norm = float(np.linalg.norm(vector))
+        return vector / norm if norm else None
+
+    def search(self, namespace: str, vector) -> Optional[str]:
+        """Return the cached response most similar to ``vector`` above the threshold."""
+        index = self._indexes.get(namespace)
+        if index is None or not index["responses"]:
+            self.stats["misses"] += 1
+            return None
+        scores = index["vectors"] @ vector
+        best = int(np.argmax(scores))
+        if scores[best] < self.threshold:
+            self.stats["misses"] += 1
+            return None
+        index["used"][best] = time.monotonic()
+        self.stats["hits"] += 1
+        return index["responses"][best]
+
+    def add(self, namespace: str, vector, response: str):
+        index = self._indexes.get(namespace)
+        if index is None or index["vectors"].shape[1] != vector.shape[0]:
+            index = {
+                "vectors": vector[None, :],
+                "responses": [response],
+                "used": [time.monotonic()],
+            }
+            self._indexes[namespace] = index
+            return
+        if len(index["responses"]) >= self.max_entries:
+            # Evict the least recently used entry
+            oldest = int(np.argmin(index["used"]))
+            index["vectors"] = np.delete(index["vectors"], oldest, axis=0)
+            del index["responses"][oldest]
+            del index["used"][oldest]
+            self.stats["evictions"] += 1
+        index["vectors"] = np.vstack([index["vectors"], vector])
+        index["responses"].append(response)
+        index["used"].append(time.monotonic())
+
+
+SEMANTIC_CACHE = (
+    SemanticCache(SEMANTIC_CACHE_THRESHOLD, SEMANTIC_CACHE_MAX_ENTRIES)
+    if SEMANTIC_CACHE_ENABLED and np is not None
+    else None
+)
+
+
+async def _astream_generation(
+    model_id: str,
+    messages: Messages,
+    options: Dict,
+    priority: int = 0,
+    tracker: Optional[CodeBlockTracker] = None,
+    prompt_tokens: int = 0,
+):
+    """Yield generation events for a request.
+
+    Deterministic requests are served from RESPONSE_CACHE when possible;
+    identical in-flight requests share one generation. With a ``tracker`` the
+    generation is stopped as soon as the expected code blocks are complete;
+    its stats are then estimated from ``prompt_tokens`` and the output.
+    """
+    cache_key = None
+    if RESPONSE_CACHE and is_deterministic(options):
+        # Key on the digest so a re-pulled model never serves stale output
+        digest = OLLAMA_ROUTER.model_digest(model_id)
+        if digest:
+            cache_key = request_key(f"{model_id}@{digest}", messages, options)
+            cached = await asyncio.to_thread(RESPONSE_CACHE.get, cache_key)
+            if cached is not None:
+                yield "delta", cached
+                yield "done", None
+                return
+
+    early_stop = {"prompt_tokens": prompt_tokens}
+    if OLLAMA_SINGLE_FLIGHT:
+        events = SINGLE_FLIGHT.stream(
+            request_key(model_id, messages, options),
+            lambda: _astream_ollama(model_id, messages, options, priority, early_stop),
+        )
+    else:
+        events = _astream_ollama(model_id, messages, options, priority, early_stop)
+
+    text = ""
+    try:
+        async for kind, value in events:
+            if kind == "delta":
+                text += value
+                if tracker is not None and tracker.feed(value):
+                    yield kind, value
+                    print(f"✂️  {model_id}: code complete, stopped generation early")
+                    METRICS.inc("ollama_coder_early_stops_total", {"model": model_id})
+                    # Read by _astream_ollama when the closed stream reaches it
+                    early_stop["output_tokens"] = TOKEN_ESTIMATOR.output_tokens(
+                        model_id, text
+                    )
+                    kind, value = "done", None
+            elif kind == "done" and tracker is not None:
+                closing = tracker.closing_text()
+                if closing:
+                    text += closing
+                    yield "delta", closing
+            if kind == "done":
+                if cache_key:
+                    await asyncio.to_thread(RESPONSE_CACHE.put, cache_key, text)
+                yield kind, value
+                return
+            yield kind, value
+    finally:
+        # Closing the event stream cancels a generation we stopped early
+        await events.aclose()
+
+
+def _history_fingerprint(turns: History) -> str:
+    return request_key("history", [[str(u), str(a)] for u, a in turns], {})
+
+
+def compacted_history(history: History, compaction: Optional[Dict]) -> History:
+    """History as it should be sent to the model.
+
+    If ``compaction`` holds a summary of the first turns of ``history``, those
+    turns are replaced by one turn carrying the summary and the latest code.
+    """
+    covered = (compaction or {}).get("covered", 0)
+    if (
+        not covered
+        or covered > len(history)
+        or compaction.get("fingerprint") != _history_fingerprint(history[:covered])
+    ):
+        return history
+    summary_turn = [
+        f"Summary of our conversation so far:\n{compaction['summary']}",
+        compaction["artifact"],
+    ]
+    return [summary_turn] + history[covered:]
+
+
+async def _compact_history(snapshot: History, compaction: Dict, model_id: str):
+    """Summarize all but the newest turns of ``snapshot`` into ``compaction``."""
+    covered = len(snapshot) - COMPACTION_KEEP_TURNS
+    try:
+        lines = []
+        start = 0
+        if compacted_history(snapshot, compaction) is not snapshot:
+            # Extend the existing summary instead of re-reading compacted turns
+            lines.append(f"Earlier summary:\n{compaction['summary']}")
+            start = compaction["covered"]
+        for user_msg, _ in snapshot[start:covered]:
+            instruction = str(_text_content(user_msg)).split(CONTEXT_MARKER, 1)[0]
+            lines.append(f"User: {instruction}")
+
+        summary_model = (
+            COMPACTION_MODEL
+            if COMPACTION_MODEL in OLLAMA_ROUTER.installed_models()
+            else model_id
+        )
+        messages = [
+            {"role": "system", "content": COMPACTION_SYSTEM_PROMPT},
+            {"role": "user", "content": "\n\n".join(lines)},
+        ]
+        # Same num_ctx bucketing as chats, so a summary on the chat model
+        # doesn't reload it
+        context_limit, reserve = await context_window(summary_model)
+        prompt_tokens = sum(
+            TOKEN_ESTIMATOR.count(summary_model, m["content"]) for m in messages
+        )
+        options = {
+            "temperature": 0.2,
+            "num_ctx": choose_num_ctx(prompt_tokens, context_limit, reserve),
+        }
+        summary = ""
+        # Low priority so interactive requests are admitted first
+        async for kind, value in _astream_ollama(
+            summary_model, messages, options, priority=100
+        ):
+            if kind == "delta":
+                summary += value
+
+        if summary.strip():
+            compaction.update(
+                summary=summary.strip(),
+                covered=covered,
+                artifact=snapshot[covered - 1][1],
+                fingerprint=_history_fingerprint(snapshot[:covered]),
+            )
+            print(f"🗜️  Compacted {covered} turns into a {len(summary)} char summary")
+    except Exception as e:
+        print(f"Compaction error: {e}")
+    finally:
+        compaction["pending"] = False
+
+
+# Background compactions in flight
+COMPACTION_TASKS: "set[asyncio.Task]" = set()
+
+
+def maybe_schedule_compaction(
+    history: History, compaction: Optional[Dict], model_id: str, system_prompt: str
+):
+    """Start a background compaction if the prompt for ``history`` is too large."""
+    if compaction is None or compaction.get("pending"):
+        return
+    prompt_history = compacted_history(history, compaction)
+    covered = compaction.get("covered", 0) if prompt_history is not history else 0
+    if len(history) - covered <= COMPACTION_KEEP_TURNS:
+        # Nothing new to summarize
+        return
+    tokens = sum(
+        TOKEN_ESTIMATOR.count(model_id, m["content"] or "")
+        for m in history_to_messages(prompt_history, system_prompt)
+    )
+    if tokens < COMPACTION_THRESHOLD_TOKENS:
+        return
+    compaction["pending"] = True
+    snapshot = [list(turn) for turn in history]
+    task = asyncio.ensure_future(_compact_history(snapshot, compaction, model_id))
+    # The event loop only keeps weak references to tasks
+    COMPACTION_TASKS.add(task)
+    task.add_done_callback(COMPACTION_TASKS.discard)
+
+
+async def _astream_chat(
     message: str,
     history: History,
     model_id: str,
     temperature: float,
     system_prompt: str,
     enable_search: bool,
+    priority: int = 0,
+    context: Optional[List[Tuple[str, str]]] = None,
+    compaction: Optional[Dict] = None,
+    artifact: Optional[str] = None,
+    output_type: Optional[str] = None,
+    session: Optional[str] = None,
 ):
-    """Main chat function with Ollama"""
-    client = get_ollama_client()
-    if not client:
-        return "Error: Ollama is not running. Please start Ollama first.", history
+    """Generation core; runs on ENGINE_LOOP and yields (partial_response, history).
+
+    ``context`` holds extra (title, text) sections such as OCR output; they are
+    sent after the message, together with any web search results. Passing a
+    per-session ``compaction`` dict enables background summarization of long
+    sessions. With ``artifact`` (the current code), earlier code versions are
+    left out of the prompt and only ``artifact`` is sent with the message.
+    ``output_type`` adds its stop sequences and ends generation once the
+    expected code blocks are complete. Generations tagged with a UI
+    ``session`` can be cancelled through GENERATIONS.
+    """
+    if not OLLAMA_ROUTER.select(model_id):
+        METRICS.inc(
+            "ollama_coder_requests_total", {"model": model_id, "status": "error"}
+        )
+        yield "Error: Ollama is not running. Please start Ollama first.", history
+        return
 
-    # Add search results to message if enabled
+    # Tavily is a blocking client; keep it off the event loop
+    search_results = None
     if enable_search and tavily_client:
-        search_results = perform_web_search(message)
-        if search_results:
-            message = f"{message}\n\nWeb Search Results:\n{search_results}"
+        search_results = await asyncio.to_thread(perform_web_search, message)
+
+    context = list(context or [])
+    if artifact:
+        context.insert(0, ("Current code", artifact))
+    if search_results:
+        context.append(("Web Search Results", search_results))
+
+    # Only self-contained first-turn prompts are answered from the semantic cache
+    semantic_vector = None
+    semantic_namespace = None
+    if SEMANTIC_CACHE and not history and not context:
+        semantic_namespace = request_key(
+            model_id, [{"role": "system", "content": system_prompt}], {}
+        )
+        semantic_vector = await SEMANTIC_CACHE.embed(message)
+        if semantic_vector is not None:
+            cached = SEMANTIC_CACHE.search(semantic_namespace, semantic_vector)
+            if cached is not None:
+                METRICS.inc(
+                    "ollama_coder_requests_total",
+                    {"model": model_id, "status": "cached"},
+                )
+                history.append([message, cached])
+                yield cached, history
+                return
+
+    # Fit the prompt into the context window and size num_ctx to match
+    context_limit, reserve = await context_window(model_id)
+    count_tokens = TOKEN_ESTIMATOR.counter(model_id)
+    prior_turns = compacted_history(history, compaction)
+    if artifact:
+        prior_turns = artifact_only_history(prior_turns)
+    message, messages = assemble_messages(
+        prior_turns,
+        system_prompt,
+        message,
+        context,
+        token_budget=context_limit - reserve,
+        count_tokens=count_tokens,
+    )
+    prompt_tokens = sum(count_tokens(m["content"] or "") for m in messages)
+    options = {
+        "temperature": temperature,
+        "num_ctx": choose_num_ctx(prompt_tokens, context_limit, reserve),
+    }
+    tracker = None
+    if output_type and EARLY_STOP_ENABLED:
+        tracker = CodeBlockTracker(output_type)
+        if output_type in OUTPUT_STOP_SEQUENCES:
+            options["stop"] = OUTPUT_STOP_SEQUENCES[output_type]
+    turn = [message, ""]
+    history.append(turn)
+
+    task = asyncio.current_task()
+    if session:
+        GENERATIONS.register(session, task, history)
+    assistant_message = ""
+    try:
+        async for kind, value in _astream_generation(
+            model_id, messages, options, priority, tracker, prompt_tokens
+        ):
+            if kind == "queued":
+                # Shown in the chat only; no code has been generated yet
+                notice = f"⏳ Waiting for `{model_id}` (queue position {value})..."
+                turn[1] = notice
+                yield "", history
+            elif kind == "delta":
+                assistant_message += value
+                turn[1] = assistant_message
+                yield assistant_message, history
+
+        turn[1] = assistant_message
+        if semantic_vector is not None and assistant_message:
+            SEMANTIC_CACHE.add(semantic_namespace, semantic_vector, assistant_message)
+        if assistant_message:
+            maybe_schedule_compaction(history, compaction, model_id, system_prompt)
+        METRICS.inc("ollama_coder_requests_total", {"model": model_id, "status": "ok"})
+        yield assistant_message, history
+
+    except asyncio.CancelledError:
+        METRICS.inc(
+            "ollama_coder_requests_total", {"model": model_id, "status": "cancelled"}
+        )
+        GENERATIONS.record_cancelled(
+            model_id, TOKEN_ESTIMATOR.output_tokens(model_id, assistant_message)
+        )
+        # A cut-off answer must not be sent back to the model
+        drop_turn(history, turn)
+        raise
+    except Exception as e:
+        METRICS.inc(
+            "ollama_coder_requests_total", {"model": model_id, "status": "error"}
+        )
+        error_msg = f"Error: {str(e)}"
+        turn[1] = error_msg
+        yield error_msg, history
+    finally:
+        if session:
+            GENERATIONS.unregister(session, task)
 
-    # Build messages
-    messages = history_to_messages(history, system_prompt)
-    messages.append({"role": "user", "content": message})
 
-    try:
-        # Non-streaming chat for simplicity
-        response = client.chat(
-            model=model_id,
-            messages=messages,
-            options={"temperature": temperature},
-            stream=False,
+def stream_chat_with_model(
+    message: str,
+    history: History,
+    model_id: str,
+    temperature: float,
+    system_prompt: str,
+    enable_search: bool,
+    **kwargs,
+):
+    """Stream a chat with Ollama, yielding (partial_response, history) as tokens arrive.
+
+    The new turn is appended to ``history`` up front and its assistant text is
+    updated in place, so every yielded history is ready to render. Extra keyword
+    arguments (``priority``, ``context``, ``compaction``, ``artifact``,
+    ``output_type``, ``session``) are passed to the generation core.
+    """
+    yield from ENGINE_LOOP.iterate(
+        _astream_chat(
+            message,
+            history,
+            model_id,
+            temperature,
+            system_prompt,
+            enable_search,
+            **kwargs,
         )
+    )
 
-        # Response shape may vary depending on client version
-        assistant_message = None
-        if isinstance(response, dict):
-            # Try common keys
-            assistant_message = (
-                (response.get("message") or {}).get("content")
-                or response.get("output")
-                or response.get("text")
-            )
-        elif isinstance(response, str):
-            assistant_message = response
 
-        assistant_message = assistant_message or ""
+async def astream_chat_with_model(
+    message: str,
+    history: History,
+    model_id: str,
+    temperature: float,
+    system_prompt: str,
+    enable_search: bool,
+    **kwargs,
+):
+    """Async version of stream_chat_with_model for async Gradio handlers."""
+    async for item in ENGINE_LOOP.aiterate(
+        _astream_chat(
+            message,
+            history,
+            model_id,
+            temperature,
+            system_prompt,
+            enable_search,
+            **kwargs,
+        )
+    ):
+        yield item
+
+
+def chat_with_model(
+    message: str,
+    history: History,
+    model_id: str,
+    temperature: float,
+    system_prompt: str,
+    enable_search: bool,
+    **kwargs,
+):
+    """Main chat function with Ollama"""
+    assistant_message = ""
+    for assistant_message, history in stream_chat_with_model(
+        message, history, model_id, temperature, system_prompt, enable_search, **kwargs
+    ):
+        pass
+    return assistant_message, history
 
-        history.append([message, assistant_message])
-        return assistant_message, history
 
-    except Exception as e:
-        error_msg = f"Error: {str(e)}"
-        history.append([message, error_msg])
-        return error_msg, history
+async def achat_with_model(
+    message: str,
+    history: History,
+    model_id: str,
+    temperature: float,
+    system_prompt: str,
+    enable_search: bool,
+    **kwargs,
+):
+    """Async version of chat_with_model"""
+    assistant_message = ""
+    async for assistant_message, history in astream_chat_with_model(
+        message, history, model_id, temperature, system_prompt, enable_search, **kwargs
+    ):
+        pass
+    return assistant_message, history
+
+
+async def throttle_stream(stream, max_fps: float):
+    """Yield items of the async iterator ``stream`` at most ``max_fps`` times
+    per second.
+
+    Items that arrive between frames are coalesced and only the latest one is
+    yielded, so this suits streams of cumulative state such as
+    (partial_response, history). The final item is always yielded.
+    """
+    if max_fps <= 0:
+        async for item in stream:
+            yield item
+        return
+
+    loop = asyncio.get_running_loop()
+    interval = 1 / max_fps
+    pending = []  # the latest item not yet yielded
+    ready = asyncio.Event()
+    finished = False
+    error = None
+
+    async def pump():
+        nonlocal finished, error
+        try:
+            async for item in stream:
+                pending[:] = [item]
+                ready.set()
+        except Exception as e:
+            error = e
+        finally:
+            finished = True
+            ready.set()
+            if hasattr(stream, "aclose"):
+                await stream.aclose()
+
+    task = asyncio.ensure_future(pump())
+    next_frame = 0.0
+    try:
+        while True:
+            if not pending and not finished:
+                ready.clear()
+                await ready.wait()
+            delay = next_frame - loop.time()
+            if delay > 0 and not finished:
+                await asyncio.sleep(delay)
+            if pending:
+                next_frame = loop.time() + interval
+                yield pending.pop()
+            elif finished:
+                if error:
+                    raise error
+                return
+    finally:
+        task.cancel()
+
+
+def get_system_prompt(output_type_value, enable_search_value):
+    """Get appropriate system prompt"""
+    if output_type_value == "HTML":
+        return (
+            HTML_SYSTEM_PROMPT_WITH_SEARCH
+            if enable_search_value
+            else HTML_SYSTEM_PROMPT
+        )
+    elif output_type_value == "Transformers.js":
+        return (
+            TRANSFORMERS_JS_SYSTEM_PROMPT_WITH_SEARCH
+            if enable_search_value
+            else TRANSFORMERS_JS_SYSTEM_PROMPT
+        )
+    elif output_type_value == "Svelte":
+        return (
+            SVELTE_SYSTEM_PROMPT_WITH_SEARCH
+            if enable_search_value
+            else SVELTE_SYSTEM_PROMPT
+        )
+    elif output_type_value == PROJECT_OUTPUT_TYPE:
+        return (
+            PROJECT_SYSTEM_PROMPT_WITH_SEARCH
+            if enable_search_value
+            else PROJECT_SYSTEM_PROMPT
+        )
+    else:
+        prompt = (
+            GENERIC_SYSTEM_PROMPT_WITH_SEARCH
+            if enable_search_value
+            else GENERIC_SYSTEM_PROMPT
+        )
+        return prompt.format(language=output_type_value.lower())
 
 
 def process_code_output(code_output: str, output_type: str) -> str:
     """Process code output based on type"""
-    if output_type == "HTML":
-        return remove_code_block(code_output)
-    elif output_type == "Transformers.js":
+    started = time.perf_counter()
+    if output_type == "Transformers.js":
         files = parse_transformers_js_output(code_output)
-        return format_transformers_js_output(files)
+        code = format_transformers_js_output(files)
     elif output_type == "Svelte":
         files = parse_svelte_output(code_output)
-        return format_svelte_output(files)
+        code = format_svelte_output(files)
+    elif output_type == PROJECT_OUTPUT_TYPE:
+        code = format_project_output(parse_project_output(code_output))
     else:
-        return remove_code_block(code_output)
+        code = remove_code_block(code_output)
+    METRICS.observe(
+        "ollama_coder_postprocess_seconds",
+        time.perf_counter() - started,
+        {"output_type": output_type},
+    )
+    return code
+
+
+def metrics_text() -> str:
+    """All metrics in the Prometheus text format, including values read now:
+    cache hit ratios, queue depth, active sessions and cancellations."""
+    gauges = []
+    if RESPONSE_CACHE:
+        stats = RESPONSE_CACHE.stats
+        for result, key in (
+            ("memory_hit", "memory_hits"),
+            ("disk_hit", "disk_hits"),
+            ("miss", "misses"),
+        ):
+            gauges.append(
+                (
+                    "ollama_coder_response_cache_lookups_total",
+                    "counter",
+                    "Response cache lookups by result.",
+                    {"result": result},
+                    stats[key],
+                )
+            )
+        gauges.append(
+            (
+                "ollama_coder_response_cache_hit_ratio",
+                "gauge",
+                "Share of response cache lookups served from the cache.",
+                {},
+                RESPONSE_CACHE.hit_ratio(),
+            )
+        )
+    if SEMANTIC_CACHE:
+        stats = SEMANTIC_CACHE.stats
+        lookups = stats["hits"] + stats["misses"]
+        for result, key in (("hit", "hits"), ("miss", "misses")):
+            gauges.append(
+                (
+                    "ollama_coder_semantic_cache_lookups_total",
+                    "counter",
+                    "Semantic cache lookups by result.",
+                    {"result": result},
+                    stats[key],
+                )
+            )
+        gauges.append(
+            (
+                "ollama_coder_semantic_cache_hit_ratio",
+                "gauge",
+                "Share of semantic cache lookups served from the cache.",
+                {},
+                stats["hits"] / lookups if lookups else 0.0,
+            )
+        )
+    for model_id in ADMISSION.models():
+        labels = {"model": model_id}
+        gauges.append(
+            (
+                "ollama_coder_queue_depth",
+                "gauge",
+                "Requests waiting for an admission slot.",
+                labels,
+                ADMISSION.queue_depth(model_id),
+            )
+        )
+        gauges.append(
+            (
+                "ollama_coder_active_requests",
+                "gauge",
+                "Requests holding an admission slot.",
+                labels,
+                ADMISSION.active(model_id),
+            )
+        )
+    sessions, generations = GENERATIONS.active_counts()
+    gauges += [
+        (
+            "ollama_coder_active_sessions",
+            "gauge",
+            "UI sessions with a generation in flight.",
+            {},
+            sessions,
+        ),
+        (
+            "ollama_coder_active_generations",
+            "gauge",
+            "Generations in flight for UI sessions.",
+            {},
+            generations,
+        ),
+        (
+            "ollama_coder_cancelled_total",
+            "counter",
+            "Generations cancelled by clear, a new message or disconnect.",
+            {},
+            GENERATIONS.stats["cancelled"],
+        ),
+        (
+            "ollama_coder_tokens_saved_total",
+            "counter",
+            "Estimated tokens not generated thanks to cancellation.",
+            {},
+            GENERATIONS.stats["tokens_saved"],
+        ),
+        (
+            "ollama_coder_coalesced_requests_total",
+            "counter",
+            "Identical concurrent requests served by one generation.",
+            {},
+            SINGLE_FLIGHT.coalesced,
+        ),
+    ]
+    return METRICS.render(gauges)
+
+
+def mount_metrics(app):
+    """Add GET /metrics to the Gradio FastAPI ``app``."""
+    from fastapi.responses import PlainTextResponse
+
+    def metrics_endpoint():
+        return PlainTextResponse(
+            metrics_text(), media_type="text/plain; version=0.0.4; charset=utf-8"
+        )
+
+    app.add_api_route(
+        "/metrics", metrics_endpoint, methods=["GET"], include_in_schema=False
+    )
+
+
+# Headless batch generation
+
+# Batch requests queue behind interactive ones for the same model
+BATCH_PRIORITY = 10
+# File extension for single-file artifacts by output type
+ARTIFACT_EXTENSIONS = {"HTML": ".html", "Python": ".py", "JavaScript": ".js"}
+
+
+def response_files(response: str, output_type: str) -> Dict[str, str]:
+    """Files in a generated response, by relative path."""
+    if output_type == "Transformers.js":
+        return parse_transformers_js_output(response)
+    if output_type == "Svelte":
+        return parse_svelte_output(response)
+    if output_type == PROJECT_OUTPUT_TYPE:
+        return parse_project_output(response)
+    extension = ARTIFACT_EXTENSIONS.get(output_type, ".txt")
+    return {f"output{extension}": process_code_output(response, output_type)}
+
+
+def write_artifact(output_dir: str, item_id: str, response: str, output_type: str):
+    """Write the files of one batch result to ``output_dir/item_id/``."""
+    root = os.path.join(output_dir, item_id)
+    written = []
+    for name, content in response_files(response, output_type).items():
+        relative = safe_relative_path(name)
+        if not relative:
+            continue
+        path = os.path.join(root, *relative.split("/"))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(content)
+        written.append(path)
+    return written
+
+
+def load_batch_items(path: str) -> List[Dict]:
+    """Read batch requests from a JSONL file.
+
+    Each line holds ``prompt`` and optionally ``id``, ``output_type``
+    (default HTML), ``model`` (default DEFAULT_MODEL_ID) and ``temperature``
+    (default 0.7). Lines without an id are numbered by position. Malformed
+    lines are reported and skipped.
+    """
+    items = []
+    with open(path, encoding="utf-8") as f:
+        for number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                item = json.loads(line)
+            except json.JSONDecodeError as e:
+                print(f"Skipping line {number}: invalid JSON ({e})")
+                continue
+            if not isinstance(item, dict):
+                print(f"Skipping line {number}: not a JSON object")
+                continue
+            if not item.get("prompt"):
+                print(f"Skipping line {number}: no prompt")
+                continue
+            item["id"] = safe_relative_path(str(item.get("id", ""))) or f"{number:05d}"
+            item.setdefault("output_type", "HTML")
+            item.setdefault("model", DEFAULT_MODEL_ID)
+            item["temperature"] = float(item.get("temperature", 0.7))
+            items.append(item)
+    return items
+
+
+def read_checkpoint(path: str) -> set:
+    """Ids of the items already recorded in the checkpoint file."""
+    if not os.path.exists(path):
+        return set()
+    with open(path, encoding="utf-8") as f:
+        return {json.loads(line)["id"] for line in f if line.strip()}
+
+
+def open_checkpoint(path: str):
+    """Open the checkpoint file for appending, creating its directory."""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    return open(path, "a", encoding="utf-8")
+
+
+async def run_batch(
+    items: List[Dict],
+    output_dir: str,
+    checkpoint_path: str,
+    per_model_concurrency: int,
+) -> Dict:
+    """Generate every item not yet in the checkpoint and write its artifacts.
+
+    At most ``per_model_concurrency`` requests per model run at once; models
+    run side by side. Each finished item is appended to the checkpoint file
+    right away, so an interrupted run resumes where it stopped. Returns a
+    summary dict.
+    """
+    completed = await asyncio.to_thread(read_checkpoint, checkpoint_path)
+    pending = [item for item in items if item["id"] not in completed]
+    summary = {
+        "done": 0,
+        "failed": 0,
+        "skipped": len(items) - len(pending),
+        "output_tokens": 0,
+    }
+    print(f"📦 Batch: {len(pending)} to generate, {summary['skipped']} already done")
+
+    checkpoint = await asyncio.to_thread(open_checkpoint, checkpoint_path)
+    slots: Dict[str, asyncio.Semaphore] = {}
+
+    async def run_item(item: Dict):
+        model = item["model"]
+        slot = slots.setdefault(model, asyncio.Semaphore(per_model_concurrency))
+        async with slot:
+            started = time.monotonic()
+            response, _ = await achat_with_model(
+                item["prompt"],
+                [],
+                model,
+                item["temperature"],
+                get_system_prompt(item["output_type"], False),
+                False,
+                priority=BATCH_PRIORITY,
+                output_type=item["output_type"],
+            )
+            seconds = time.monotonic() - started
+        if not response or response.startswith("Error: "):
+            summary["failed"] += 1
+            print(f"❌ {item['id']} ({model}): {response or 'empty response'}")
+            return
+        paths = await asyncio.to_thread(
+            write_artifact, output_dir, item["id"], response, item["output_type"]
+        )
+        checkpoint.write(
+            json.dumps({"id": item["id"], "model": model, "seconds": round(seconds, 2)})
+            + "\n"
+        )
+        checkpoint.flush()
+        summary["done"] += 1
+        # Generations may be served from the cache or stopped early, so use
+        # the estimator, which is calibrated against Ollama's counts
+        summary["output_tokens"] += TOKEN_ESTIMATOR.output_tokens(model, response)
+        print(f"✅ {item['id']} ({model}, {seconds:.1f}s): {len(paths)} file(s)")
+
+    started = time.monotonic()
+    try:
+        await asyncio.gather(*(run_item(item) for item in pending))
+    finally:
+        checkpoint.close()
+    summary["seconds"] = time.monotonic() - started
+    return summary
+
+
+def print_batch_summary(summary: Dict):
+    seconds = max(summary["seconds"], 1e-9)
+    print(
+        f"\n📊 Batch finished in {seconds:.1f}s: {summary['done']} done, "
+        f"{summary['failed']} failed, {summary['skipped']} skipped"
+    )
+    print(
+        f"   ~{summary['output_tokens']} output tokens, "
+        f"{summary['output_tokens'] / seconds:.1f} tokens/s, "
+        f"{summary['done'] / seconds * 60:.1f} prompts/min"
+    )
 
 
 # Gradio Interface
@@ -991,6 +3669,7 @@ def create_interface():
                     label="Select Model",
                     interactive=True,
                 )
+                model_status = gr.Markdown("")
 
                 temperature = gr.Slider(
                     minimum=0,
@@ -1007,6 +3686,7 @@ def create_interface():
                         "Svelte",
                         "Python",
                         "JavaScript",
+                        PROJECT_OUTPUT_TYPE,
                         "Other",
                     ],
                     value="HTML",
@@ -1021,6 +3701,24 @@ def create_interface():
                     visible=bool(tavily_client),
                 )
 
+                # Ask for SEARCH/REPLACE patches when modifying existing code
+                diff_edits = gr.Checkbox(
+                    label="Edit existing code with diffs",
+                    value=DIFF_EDITS_ENABLED,
+                )
+
+                # Leave earlier code versions out of the prompt
+                artifact_context = gr.Checkbox(
+                    label="Send only the latest code",
+                    value=ARTIFACT_CONTEXT_ENABLED,
+                )
+
+                # Summarize older turns of long sessions in the background
+                compact_sessions = gr.Checkbox(
+                    label="Compact long sessions",
+                    value=COMPACTION_ENABLED,
+                )
+
                 # Demo examples
                 gr.Markdown("### Quick Examples")
                 example_buttons = []
@@ -1052,6 +3750,9 @@ def create_interface():
                     clear_btn = gr.Button("Clear Chat")
                     gr.Button("Copy Last Code")
 
+                # File tabs for multi-file projects
+                project_files = gr.Radio(label="Files", choices=[], visible=False)
+
                 # Code output
                 code_output = gr.Code(
                     label="Generated Code",
@@ -1062,12 +3763,30 @@ def create_interface():
                 # HTML Preview (only shown for HTML output)
                 html_preview = gr.HTML(label="Preview", visible=False)
 
+                # Zip download for multi-file projects
+                project_zip_btn = gr.Button("📦 Download Project (.zip)", visible=False)
+                project_zip = gr.File(label="Project Archive", visible=False)
+
         # State
         history = gr.State([])
         last_code = gr.State("")
+        # Parsed project files {path: content}; last_code only holds their
+        # display text, which can't always be parsed back
+        project_state = gr.State({})
+        compaction = gr.State({})
 
         def update_interface(output_type_value):
             """Update interface based on output type"""
+            is_project = output_type_value == PROJECT_OUTPUT_TYPE
+            return (
+                *update_code_panel(output_type_value),
+                gr.update(visible=is_project),
+                gr.update(visible=is_project),
+                gr.update(visible=False),
+            )
+
+        def update_code_panel(output_type_value):
+            """Preview visibility and code language for an output type"""
             if output_type_value == "HTML":
                 return gr.update(visible=True), gr.update(language="html")
             elif output_type_value == "Transformers.js":
@@ -1079,81 +3798,295 @@ def create_interface():
             else:
                 return gr.update(visible=False), gr.update(language=None)
 
-        def get_system_prompt(output_type_value, enable_search_value):
-            """Get appropriate system prompt"""
-            if output_type_value == "HTML":
-                return (
-                    HTML_SYSTEM_PROMPT_WITH_SEARCH
-                    if enable_search_value
-                    else HTML_SYSTEM_PROMPT
-                )
-            elif output_type_value == "Transformers.js":
-                return (
-                    TRANSFORMERS_JS_SYSTEM_PROMPT_WITH_SEARCH
-                    if enable_search_value
-                    else TRANSFORMERS_JS_SYSTEM_PROMPT
-                )
-            elif output_type_value == "Svelte":
-                return (
-                    SVELTE_SYSTEM_PROMPT_WITH_SEARCH
-                    if enable_search_value
-                    else SVELTE_SYSTEM_PROMPT
-                )
-            else:
-                prompt = (
-                    GENERIC_SYSTEM_PROMPT_WITH_SEARCH
-                    if enable_search_value
-                    else GENERIC_SYSTEM_PROMPT
+        def render_outputs(response, history_state, output_type_value):
+            """Build the (chatbot, history, code, last_code, preview) output tuple"""
+            if output_type_value == PROJECT_OUTPUT_TYPE:
+                files = parse_project_output(response)
+                return render_code_outputs(
+                    format_project_output(files),
+                    history_state,
+                    output_type_value,
+                    files=files,
                 )
-                return prompt.format(language=output_type_value.lower())
+            processed_code = process_code_output(response, output_type_value)
+            return render_code_outputs(processed_code, history_state, output_type_value)
 
-        def chat_and_update(
-            message, history_state, model, temp, output_type_value, enable_search_value
+        def render_code_outputs(
+            processed_code, history_state, output_type_value, files=None, selected=None
         ):
-            """Handle chat and update all outputs"""
-            if not message:
-                return history_state, history_state, "", "", gr.update(visible=False)
-
-            system_prompt = get_system_prompt(output_type_value, enable_search_value)
-
-            # Get response
-            response, new_history = chat_with_model(
-                message, history_state, model, temp, system_prompt, enable_search_value
-            )
+            """Output tuple for already processed code"""
+            # Convert history to chatbot format
+            chatbot_messages = history_to_chatbot_messages(history_state)
 
-            # Process code
-            processed_code = process_code_output(response, output_type_value)
+            # Projects show one file at a time; the files stay server-side
+            if output_type_value == PROJECT_OUTPUT_TYPE:
+                files = files or {}
+                if selected not in files:
+                    selected = next(iter(files), None)
+                return (
+                    chatbot_messages,
+                    history_state,
+                    project_file_update(files, selected),
+                    processed_code,
+                    gr.update(visible=False),
+                    gr.update(choices=list(files), value=selected, visible=True),
+                    files,
+                )
 
             # Update preview if HTML
             preview_update = gr.update(visible=False)
             if output_type_value == "HTML" and processed_code:
                 preview_update = gr.update(value=processed_code, visible=True)
 
-            # Convert history to chatbot format
-            chatbot_messages = history_to_chatbot_messages(new_history)
-
             return (
                 chatbot_messages,
-                new_history,
+                history_state,
                 processed_code,
                 processed_code,
                 preview_update,
+                gr.update(visible=False),
+                {},
+            )
+
+        def project_file_update(files, selected):
+            """Code panel update showing one project file"""
+            extension = posixpath.splitext(selected or "")[1].lower()
+            return gr.update(
+                value=files.get(selected, ""),
+                language=CODE_LANGUAGE_BY_EXTENSION.get(extension),
             )
 
-        def clear_chat():
-            return [], [], "", "", gr.update(visible=False)
+        def show_project_file(selected, files):
+            return project_file_update(files, selected)
+
+        def download_project(files, request: gr.Request = None):
+            session = request.session_hash if request else None
+            path = write_project_zip(files, session)
+            return gr.update(value=path, visible=path is not None)
+
+        async def render_stream(chat_stream, output_type_value):
+            """Render a chat stream, extracting the code as it forms.
+
+            Frames are capped at UI_FRAME_RATE and the preview iframe is
+            refreshed at PREVIEW_FRAME_RATE; the final state is always sent.
+            """
+            extractor = CodeStreamExtractor(output_type_value)
+            streamed = 0
+            preview_interval = (
+                1 / PREVIEW_FRAME_RATE if PREVIEW_FRAME_RATE > 0 else None
+            )
+            preview_at = time.monotonic()
+            response, history_state = "", []
+            try:
+                async for response, history_state in throttle_stream(
+                    chat_stream, UI_FRAME_RATE
+                ):
+                    extractor.feed(response[streamed:])
+                    streamed = len(response)
+                    outputs = render_code_outputs(
+                        extractor.code(),
+                        history_state,
+                        output_type_value,
+                        files=extractor.files(),
+                        selected=extractor.current,
+                    )
+                    # last_code and the project files are only set once the
+                    # response is complete; a cancelled generation leaves the
+                    # previous code in place for the next edit
+                    chatbot_messages, _, code, _, preview, tabs, _ = outputs
+                    now = time.monotonic()
+                    if preview_interval is None or now - preview_at < preview_interval:
+                        # Leave the preview as it is for this frame
+                        preview = gr.update()
+                    else:
+                        preview_at = now
+                    yield (
+                        chatbot_messages,
+                        history_state,
+                        code,
+                        gr.update(),
+                        preview,
+                        tabs,
+                        gr.update(),
+                    )
+            except GenerationCancelled:
+                # Superseded by a new message or the session went away; a cut-off
+                # response is not the final code
+                return
+            # The full parsers have the final say
+            yield render_outputs(response, history_state, output_type_value)
+
+        async def chat_and_update(
+            message,
+            history_state,
+            model,
+            temp,
+            output_type_value,
+            enable_search_value,
+            compact_value,
+            compaction_state,
+            diff_value,
+            artifact_value,
+            last_code_value,
+            request: gr.Request = None,
+        ):
+            """Handle chat and stream updates to all outputs"""
+            # A new message replaces whatever this session is still generating
+            session = request.session_hash if request else None
+            GENERATIONS.cancel(session)
+            if not message:
+                yield (
+                    history_state,
+                    history_state,
+                    "",
+                    "",
+                    gr.update(visible=False),
+                    gr.update(),
+                    gr.update(),
+                )
+                return
+
+            system_prompt = get_system_prompt(output_type_value, enable_search_value)
+            compaction_arg = compaction_state if compact_value else None
+            context = None
+            # Send only the latest code instead of every earlier version
+            artifact = last_code_value if artifact_value and last_code_value else None
+            # The code is sent once: not again if the last answer already holds
+            # it (assemble_messages keeps context in history)
+            code_context = None
+            if not artifact and not last_turn_has_code(
+                history_state, last_code_value, output_type_value
+            ):
+                code_context = [("Current code", last_code_value)]
+
+            followup_prompt = FOLLOW_UP_PROMPTS.get(output_type_value)
+            if diff_value and followup_prompt and last_code_value:
+                # Ask only for SEARCH/REPLACE blocks against the current code; the
+                # code panel keeps showing it until the patch is applied
+                response = ""
+                chat_stream = astream_chat_with_model(
+                    message,
+                    history_state,
+                    model,
+                    temp,
+                    followup_prompt,
+                    enable_search_value,
+                    context=code_context,
+                    compaction=compaction_arg,
+                    artifact=artifact,
+                    session=session,
+                )
+                try:
+                    async for response, new_history in throttle_stream(
+                        chat_stream, UI_FRAME_RATE
+                    ):
+                        yield (
+                            history_to_chatbot_messages(new_history),
+                            new_history,
+                            last_code_value,
+                            last_code_value,
+                            gr.update(),
+                            gr.update(),
+                            gr.update(),
+                        )
+                except GenerationCancelled:
+                    # A truncated patch would fail to apply and trigger the full
+                    # regeneration below
+                    return
+
+                patched = apply_search_replace(
+                    last_code_value, response, output_type_value
+                )
+                if patched is None:
+                    # A reply with the whole file instead of patches is used as is
+                    patched = code_from_full_reply(response, output_type_value)
+                if patched is not None:
+                    # Later turns and compaction expect code in the history,
+                    # not a patch
+                    history_state[-1][1] = code_as_response(patched, output_type_value)
+                    yield render_code_outputs(patched, history_state, output_type_value)
+                    return
+                if response.startswith("Error"):
+                    return
+
+                # The patch did not apply: drop that turn and regenerate the file
+                print("SEARCH/REPLACE patch did not apply; regenerating the full file")
+                history_state.pop()
+                context = code_context
+
+            # Push partial code to the code panel and preview as tokens arrive
+            chat_stream = astream_chat_with_model(
+                message,
+                history_state,
+                model,
+                temp,
+                system_prompt,
+                enable_search_value,
+                context=context,
+                compaction=compaction_arg,
+                artifact=artifact,
+                output_type=output_type_value,
+                session=session,
+            )
+            async for outputs in render_stream(chat_stream, output_type_value):
+                yield outputs
+
+        async def warm_selected_model(model_id):
+            """Preload the selected model and report its load state"""
+            if not model_id or not OLLAMA_WARMUP:
+                yield ""
+                return
+            yield MODEL_WARMER.describe(model_id)
+            await ENGINE_LOOP.arun(MODEL_WARMER.warm(model_id))
+            yield MODEL_WARMER.describe(model_id)
+
+        def clear_chat(request: gr.Request = None):
+            # Stop generating for this session; the cancels= below stop the handlers
+            GENERATIONS.cancel(request.session_hash if request else None)
+            return (
+                [],
+                [],
+                "",
+                "",
+                gr.update(visible=False),
+                {},
+                gr.update(choices=[], value=None),
+                gr.update(value=None, visible=False),
+                {},
+            )
 
         def copy_to_clipboard(code):
             return gr.update(value="Copied to clipboard!")
 
         # Event handlers
+        model_dropdown.change(
+            warm_selected_model, inputs=[model_dropdown], outputs=[model_status]
+        )
+        demo.load(warm_selected_model, inputs=[model_dropdown], outputs=[model_status])
+
         output_type.change(
             update_interface,
             inputs=[output_type],
-            outputs=[html_preview, code_output],
+            outputs=[
+                html_preview,
+                code_output,
+                project_files,
+                project_zip_btn,
+                project_zip,
+            ],
+        )
+
+        # Only user clicks switch files; streamed updates set the value too
+        project_files.input(
+            show_project_file,
+            inputs=[project_files, project_state],
+            outputs=[code_output],
+        )
+        project_zip_btn.click(
+            download_project, inputs=[project_state], outputs=[project_zip]
         )
 
-        submit_btn.click(
+        submit_event = submit_btn.click(
             chat_and_update,
             inputs=[
                 msg,
@@ -1162,9 +4095,24 @@ def create_interface():
                 temperature,
                 output_type,
                 enable_search,
+                compact_sessions,
+                compaction,
+                diff_edits,
+                artifact_context,
+                last_code,
+            ],
+            outputs=[
+                chatbot,
+                history,
+                code_output,
+                last_code,
+                html_preview,
+                project_files,
+                project_state,
             ],
-            outputs=[chatbot, history, code_output, last_code, html_preview],
-        ).then(lambda: "", outputs=[msg])
+            concurrency_id="generation",
+        )
+        submit_event.then(lambda: "", outputs=[msg])
 
         # OCR helper: return extracted text or an error message
         def ocr_from_image(image):
@@ -1172,12 +4120,17 @@ def create_interface():
                 return "Error: pytesseract or Pillow not installed on the server. Install pytesseract and pillow."
             if image is None:
                 return ""
+            started = time.perf_counter()
             try:
                 # image is a PIL Image
                 text = pytesseract.image_to_string(image).strip()
                 return text
             except Exception as e:
                 return f"OCR error: {e}"
+            finally:
+                METRICS.observe(
+                    "ollama_coder_ocr_seconds", time.perf_counter() - started
+                )
 
         # Button handlers for image flows
         def handle_extract_text(image):
@@ -1185,54 +4138,60 @@ def create_interface():
             # Place extracted text into the message box so user can review
             return text
 
-        def handle_generate_from_image(
-            image, history_state, model, temp, output_type_value, enable_search_value
+        async def handle_generate_from_image(
+            image,
+            history_state,
+            model,
+            temp,
+            output_type_value,
+            enable_search_value,
+            compact_value,
+            compaction_state,
+            request: gr.Request = None,
         ):
-            # Extract text first
-            extracted = ocr_from_image(image)
+            session = request.session_hash if request else None
+            GENERATIONS.cancel(session)
+            # Extract text first (tesseract is CPU-bound, keep it off the event loop)
+            extracted = await asyncio.to_thread(ocr_from_image, image)
             if extracted.startswith("Error"):
                 # propagate error into chat
                 assistant = extracted
                 history_state.append(["(image)", assistant])
-                return (
+                yield (
                     history_to_chatbot_messages(history_state),
                     history_state,
                     assistant,
                     assistant,
                     gr.update(visible=False),
+                    gr.update(visible=False),
+                    {},
                 )
+                return
 
-            # Build a prompt that asks the model to synthesize HTML/CSS from OCR + inferred layout
+            # Build a prompt that asks the model to synthesize HTML/CSS from OCR + inferred layout.
+            # The fixed instructions come first; the OCR text is sent as trailing context.
             prompt = (
-                f"You are an expert frontend developer. Based on the text and visual cues below (extracted from an image), generate a single-file responsive HTML + CSS. "
-                f"Use semantic HTML, modern CSS, and include a mobile-friendly hamburger menu if necessary.\n\nExtracted text and labels:\n{extracted}\n\nIf layout hints are absent, infer a sensible layout. Return only the HTML inside a code block."
+                "You are an expert frontend developer. Based on the text and visual cues extracted from an image (given below), generate a single-file responsive HTML + CSS. "
+                "Use semantic HTML, modern CSS, and include a mobile-friendly hamburger menu if necessary. If layout hints are absent, infer a sensible layout. Return only the HTML inside a code block."
             )
 
-            response, new_history = chat_with_model(
+            chat_stream = astream_chat_with_model(
                 prompt,
                 history_state,
                 model,
                 temp,
                 get_system_prompt(output_type_value, enable_search_value),
                 enable_search_value,
+                context=[("Extracted text and labels", extracted)],
+                compaction=compaction_state if compact_value else None,
+                output_type=output_type_value,
+                session=session,
             )
-
-            processed_code = process_code_output(response, output_type_value)
-            preview_update = gr.update(visible=False)
-            if output_type_value == "HTML" and processed_code:
-                preview_update = gr.update(value=processed_code, visible=True)
-
-            chatbot_messages = history_to_chatbot_messages(new_history)
-            return (
-                chatbot_messages,
-                new_history,
-                processed_code,
-                processed_code,
-                preview_update,
-            )
+            async for outputs in render_stream(chat_stream, output_type_value):
+                yield outputs
 
         extract_text_btn.click(handle_extract_text, inputs=[image_input], outputs=[msg])
-        gen_from_image_btn.click(
+        image_event = gen_from_image_btn.click(
             handle_generate_from_image,
             inputs=[
                 image_input,
@@ -1241,11 +4200,22 @@ def create_interface():
                 temperature,
                 output_type,
                 enable_search,
+                compact_sessions,
+                compaction,
             ],
-            outputs=[chatbot, history, code_output, last_code, html_preview],
+            outputs=[
+                chatbot,
+                history,
+                code_output,
+                last_code,
+                html_preview,
+                project_files,
+                project_state,
+            ],
+            concurrency_id="generation",
         )
 
-        msg.submit(
+        msg_event = msg.submit(
             chat_and_update,
             inputs=[
                 msg,
@@ -1254,22 +4224,89 @@ def create_interface():
                 temperature,
                 output_type,
                 enable_search,
+                compact_sessions,
+                compaction,
+                diff_edits,
+                artifact_context,
+                last_code,
+            ],
+            outputs=[
+                chatbot,
+                history,
+                code_output,
+                last_code,
+                html_preview,
+                project_files,
+                project_state,
             ],
-            outputs=[chatbot, history, code_output, last_code, html_preview],
-        ).then(lambda: "", outputs=[msg])
+            concurrency_id="generation",
+        )
+        msg_event.then(lambda: "", outputs=[msg])
 
         clear_btn.click(
-            clear_chat, outputs=[chatbot, history, code_output, last_code, html_preview]
+            clear_chat,
+            outputs=[
+                chatbot,
+                history,
+                code_output,
+                last_code,
+                html_preview,
+                compaction,
+                project_files,
+                project_zip,
+                project_state,
+            ],
+            cancels=[submit_event, msg_event, image_event],
         )
 
+        # Closing the tab stops the session's generations and removes its files
+        def cancel_session_generations(request: gr.Request):
+            GENERATIONS.cancel(request.session_hash)
+            remove_project_zip(request.session_hash)
+
+        demo.unload(cancel_session_generations)
+
         # Example buttons
         for btn, example_text in example_buttons:
             btn.click(lambda x: x, inputs=[gr.State(example_text)], outputs=[msg])
 
+    # Generation handlers are async, so one worker can wait on many Ollama
+    # requests at once; these limits bound how many run and how many may queue
+    demo.queue(
+        default_concurrency_limit=GRADIO_CONCURRENCY_LIMIT,
+        max_size=GRADIO_MAX_QUEUE_SIZE,
+    )
     return demo
 
 
+def parse_args():
+    parser = argparse.ArgumentParser(description="Local Code Assistant with Ollama")
+    parser.add_argument(
+        "--batch",
+        metavar="JSONL",
+        help="generate the prompts in this JSONL file headlessly instead of starting the UI",
+    )
+    parser.add_argument(
+        "--output-dir",
+        default="batch_output",
+        help="where batch artifacts are written (default: batch_output)",
+    )
+    parser.add_argument(
+        "--checkpoint",
+        help="file recording finished batch items (default: OUTPUT_DIR/checkpoint.jsonl)",
+    )
+    parser.add_argument(
+        "--per-model-concurrency",
+        type=int,
+        default=2,
+        help="concurrent batch requests per model (default: 2)",
+    )
+    return parser.parse_args()
+
+
 if __name__ == "__main__":
+    args = parse_args()
+
     # Check if Ollama is running
     if not get_ollama_client():
         print("⚠️  Warning: Ollama is not running!")
@@ -1286,6 +4323,22 @@ if __name__ == "__main__":
     print(f"✅ Found {len(AVAILABLE_MODELS)} Ollama models")
     print(f"📍 Default model: {DEFAULT_MODEL_ID}")
 
+    if args.batch:
+        summary = asyncio.run(
+            run_batch(
+                load_batch_items(args.batch),
+                args.output_dir,
+                args.checkpoint or os.path.join(args.output_dir, "checkpoint.jsonl"),
+                max(1, args.per_model_concurrency),
+            )
+        )
+        print_batch_summary(summary)
+        exit(1 if summary["failed"] else 0)
+
+    # Start loading the default model now so the first request doesn't pay for it
+    if OLLAMA_WARMUP and DEFAULT_MODEL_ID:
+        MODEL_WARMER.warm_in_background(DEFAULT_MODEL_ID)
+
     if not tavily_client:
         print("ℹ️  Web search disabled (no TAVILY_API_KEY)")
     else:
@@ -1298,4 +4351,10 @@ if __name__ == "__main__":
         server_port=7860,
         share=False,
         inbrowser=True,
+        prevent_thread_lock=METRICS_ENABLED,
     )
+    if METRICS_ENABLED:
+        # The FastAPI app only exists once Gradio has launched
+        mount_metrics(demo.app)
+        print("📈 Prometheus metrics at http://0.0.0.0:7860/metrics")
+        demo.block_thread()
@@ -8,7 +8,7 @@ from tavily import TavilyClient
 import gradio as gr
 from src.rag import (
     process_and_initialize,
-    user_query_typing_effect,
+    auser_query_typing_effect,
     test_ollama_connection,
 )
 
@@ -475,6 +475,9 @@ DEMO_LIST = [
 
 # Ollama Configuration
 OLLAMA_BASE_URL = os.getenv("OLLAMA_BASE_URL", "http://localhost:11434")
+# Gradio queue: concurrent events per worker and maximum queued events
+GRADIO_CONCURRENCY_LIMIT = int(os.getenv("GRADIO_CONCURRENCY_LIMIT", "32"))
+GRADIO_MAX_QUEUE_SIZE = int(os.getenv("GRADIO_MAX_QUEUE_SIZE", "256"))
 
 
 def get_ollama_client():
@@ -1324,11 +1327,12 @@ def create_interface():
             show_progress=True,
         )
 
-        def rag_ask_handler(query, qa_chain, chat_state):
+        async def rag_ask_handler(query, qa_chain, chat_state):
             if not qa_chain:
-                return chat_state, ""
-            # user_query_typing_effect is a generator; we need to yield from it
-            for history, status in user_query_typing_effect(
+                yield chat_state, ""
+                return
+            # Async generator: the worker is free while the LLM generates
+            async for history, status in auser_query_typing_effect(
                 query, qa_chain, chat_state
             ):
                 yield history, status
@@ -1360,6 +1364,10 @@ def create_interface():
         for btn, example_text in example_buttons:
             btn.click(lambda x: x, inputs=[gr.State(example_text)], outputs=[msg])
 
+    demo.queue(
+        default_concurrency_limit=GRADIO_CONCURRENCY_LIMIT,
+        max_size=GRADIO_MAX_QUEUE_SIZE,
+    )
     return demo
 
 
@@ -4,6 +4,7 @@ from .rag import (
     test_ollama_connection,
     process_and_initialize,
     user_query_typing_effect,
+    auser_query_typing_effect,
     initialize_chatbot,
     load_doc,
     create_db,
@@ -13,6 +14,7 @@ __all__ = [
     "test_ollama_connection",
     "process_and_initialize",
     "user_query_typing_effect",
+    "auser_query_typing_effect",
     "initialize_chatbot",
     "load_doc",
     "create_db",
@@ -21,3 +21,7 @@ PREFERRED_MODELS = [m.strip() for m in MODEL_PREFERENCE.split(",") if m.strip()]
 
 # Embedding model used by the RAG pipeline
 EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "sentence-transformers/all-MiniLM-L6-v2")
+
+# Minimum seconds between streamed UI updates; tokens arriving in between are
+# grouped into a single frame
+STREAM_FRAME_INTERVAL = float(os.getenv("STREAM_FRAME_INTERVAL", "0.05"))
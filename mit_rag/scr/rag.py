@@ -1,6 +1,19 @@
+import asyncio
+import queue
+import threading
 import time
 from typing import List, Tuple, Any
-from .config import OLLAMA_HOST, MODEL_NAME, EMBEDDING_MODEL, PREFERRED_MODELS
+from .config import (
+    OLLAMA_HOST,
+    MODEL_NAME,
+    EMBEDDING_MODEL,
+    PREFERRED_MODELS,
+    STREAM_FRAME_INTERVAL,
+)
+
+# Tag attached to the answer LLM so streamed tokens from the question
+# condensing step are not shown to the user
+ANSWER_LLM_TAG = "rag_answer"
 
 
 def test_ollama_connection() -> Tuple[bool, str]:
@@ -108,10 +121,20 @@ def initialize_chatbot(vector_db):
     except Exception:
         pass
 
-    llm = Ollama(model=model_to_use, base_url=OLLAMA_HOST, temperature=0.5)
+    llm = Ollama(
+        model=model_to_use,
+        base_url=OLLAMA_HOST,
+        temperature=0.5,
+        tags=[ANSWER_LLM_TAG],
+    )
+    condense_llm = Ollama(model=model_to_use, base_url=OLLAMA_HOST, temperature=0.5)
 
     qa_chain = ConversationalRetrievalChain.from_llm(
-        llm=llm, retriever=retriever, memory=memory, verbose=False
+        llm=llm,
+        condense_question_llm=condense_llm,
+        retriever=retriever,
+        memory=memory,
+        verbose=False,
     )
     return qa_chain
 
@@ -140,17 +163,157 @@ def process_and_initialize(files: List[Any]):
         return None, None, f"Processing error: {str(e)}"
 
 
+def _answer_token_handler(put, is_async: bool = False):
+    """Build a callback handler that passes answer LLM tokens to ``put``."""
+    from langchain_core.callbacks import AsyncCallbackHandler, BaseCallbackHandler
+
+    answer_runs = set()
+
+    class AnswerTokenHandler(BaseCallbackHandler):
+        def on_llm_start(self, serialized, prompts, *, run_id, tags=None, **kwargs):
+            if tags and ANSWER_LLM_TAG in tags:
+                answer_runs.add(run_id)
+
+        def on_llm_new_token(self, token, *, run_id, **kwargs):
+            if run_id in answer_runs:
+                put(token)
+
+    class AsyncAnswerTokenHandler(AsyncCallbackHandler):
+        async def on_llm_start(
+            self, serialized, prompts, *, run_id, tags=None, **kwargs
+        ):
+            if tags and ANSWER_LLM_TAG in tags:
+                answer_runs.add(run_id)
+
+        async def on_llm_new_token(self, token, *, run_id, **kwargs):
+            if run_id in answer_runs:
+                put(token)
+
+    return AsyncAnswerTokenHandler() if is_async else AnswerTokenHandler()
+
+
+_STREAM_DONE = object()
+
+
+class _FrameBatcher:
+    """Groups streamed tokens into frames at least STREAM_FRAME_INTERVAL apart,
+    so the browser is not sent the whole history once per token."""
+
+    def __init__(self, message: dict):
+        self.message = message
+        self.last_frame = time.monotonic()
+        self.pending = False
+
+    def timeout(self):
+        """How long to wait for the next token before flushing a frame."""
+        if not self.pending:
+            return None
+        return max(0.0, self.last_frame + STREAM_FRAME_INTERVAL - time.monotonic())
+
+    def add(self, token) -> bool:
+        """Append ``token`` (None when the wait timed out) to the message and
+        return True when a frame should be sent."""
+        if token is not None:
+            self.message["content"] += token
+            self.pending = True
+            if time.monotonic() - self.last_frame < STREAM_FRAME_INTERVAL:
+                return False
+        if not self.pending:
+            return False
+        self.last_frame = time.monotonic()
+        self.pending = False
+        return True
+
+
 def user_query_typing_effect(query: str, qa_chain, chatbot):
+    """Stream the RAG answer into the chatbot as the LLM generates it.
+
+    Tokens are grouped into frames of at least STREAM_FRAME_INTERVAL seconds so
+    the browser is not sent the whole history once per token.
+    """
     history = chatbot or []
-    try:
-        response = qa_chain.invoke({"question": query, "chat_history": []})
-        assistant_response = response["answer"]
-        history.append({"role": "user", "content": query})
-        history.append({"role": "assistant", "content": ""})
-        for i in range(len(assistant_response)):
-            history[-1]["content"] += assistant_response[i]
+    history.append({"role": "user", "content": query})
+    history.append({"role": "assistant", "content": ""})
+
+    tokens: "queue.Queue" = queue.Queue()
+    result = {}
+
+    def run_chain():
+        try:
+            result["response"] = qa_chain.invoke(
+                {"question": query, "chat_history": []},
+                config={"callbacks": [_answer_token_handler(tokens.put)]},
+            )
+        except Exception as e:
+            result["error"] = e
+        finally:
+            tokens.put(_STREAM_DONE)
+
+    threading.Thread(target=run_chain, daemon=True).start()
+
+    frames = _FrameBatcher(history[-1])
+    while True:
+        try:
+            token = tokens.get(timeout=frames.timeout())
+        except queue.Empty:
+            token = None
+        if token is _STREAM_DONE:
+            break
+        if frames.add(token):
             yield history, ""
-            time.sleep(0.03)
+
+    if "error" in result:
+        history[-1]["content"] = f"Error: {str(result['error'])}"
+    else:
+        # The chain's final answer is authoritative (e.g. if nothing was streamed)
+        history[-1]["content"] = result["response"]["answer"]
+    yield history, ""
+
+
+async def auser_query_typing_effect(query: str, qa_chain, chatbot):
+    """Async version of user_query_typing_effect for async Gradio handlers.
+
+    Runs the chain with ``ainvoke`` on the caller's event loop, so no worker
+    thread is held while the LLM generates.
+    """
+    history = chatbot or []
+    history.append({"role": "user", "content": query})
+    history.append({"role": "assistant", "content": ""})
+
+    tokens: "asyncio.Queue" = asyncio.Queue()
+
+    async def run_chain():
+        try:
+            return await qa_chain.ainvoke(
+                {"question": query, "chat_history": []},
+                config={
+                    "callbacks": [
+                        _answer_token_handler(tokens.put_nowait, is_async=True)
+                    ]
+                },
+            )
+        finally:
+            tokens.put_nowait(_STREAM_DONE)
+
+    task = asyncio.ensure_future(run_chain())
+    try:
+        frames = _FrameBatcher(history[-1])
+        while True:
+            try:
+                token = await asyncio.wait_for(tokens.get(), frames.timeout())
+            except asyncio.TimeoutError:
+                token = None
+            if token is _STREAM_DONE:
+                break
+            if frames.add(token):
+                yield history, ""
+    finally:
+        if not task.done():
+            task.cancel()
+
+    try:
+        response = await task
+        history[-1]["content"] = response["answer"]
     except Exception as e:
-        history.append({"role": "assistant", "content": f"Error: {str(e)}"})
-        yield history, ""
+        history[-1]["content"] = f"Error: {str(e)}"
+    yield history, ""
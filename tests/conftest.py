@@ -0,0 +1,28 @@
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+
+from mock_ollama import MockOllama  # noqa: E402
+
+# One in-process mock Ollama for the whole run, started before main is
+# imported since main reads its configuration at import time
+MOCK_OLLAMA = MockOllama(ttft=0.0, tokens_per_second=0.0)
+os.environ["OLLAMA_BASE_URL"] = MOCK_OLLAMA.start()
+os.environ.setdefault("LOG_GENERATION_STATS", "0")
+os.environ.setdefault("RESPONSE_CACHE", "0")
+os.environ.setdefault("OLLAMA_WARMUP", "0")
+
+
+@pytest.fixture
+def mock_ollama(monkeypatch):
+    """The mock server with an empty request log; settings changed by a test
+    are restored afterwards."""
+    for name in ("ttft", "tokens_per_second", "response", "script"):
+        monkeypatch.setattr(MOCK_OLLAMA, name, getattr(MOCK_OLLAMA, name))
+    MOCK_OLLAMA.requests.clear()
+    return MOCK_OLLAMA
@@ -0,0 +1,375 @@
+"""Generation paths end to end against the in-process mock Ollama."""
+
+import asyncio
+import time
+import types
+
+import pytest
+
+import main
+
+MODEL = "llama3.2:3b"
+SYSTEM_PROMPT = main.get_system_prompt("HTML", False)
+PAGE = "<!DOCTYPE html>\n<html>\n<body>\n  <h1>Hello</h1>\n</body>\n</html>"
+
+
+def chat_requests(mock):
+    return [body for path, body in mock.requests if path == "/api/chat"]
+
+
+async def collect(agen):
+    return [item async for item in agen]
+
+
+@pytest.fixture(scope="module")
+def handlers():
+    demo = main.create_interface()
+    return {f.fn.__name__: f.fn for f in demo.fns.values() if f.fn}
+
+
+def chat(
+    handlers,
+    message,
+    output_type,
+    session,
+    history=None,
+    last_code="",
+    diff=False,
+    cancel_after=None,
+):
+    """Run one turn through the chat handler and return its outputs,
+    cancelling the session's generation after ``cancel_after`` seconds."""
+    request = types.SimpleNamespace(session_hash=session)
+
+    async def scenario():
+        task = asyncio.ensure_future(
+            collect(
+                handlers["chat_and_update"](
+                    message,
+                    [] if history is None else history,
+                    MODEL,
+                    0.7,
+                    output_type,
+                    False,
+                    False,
+                    {},
+                    diff,
+                    False,
+                    last_code,
+                    request,
+                )
+            )
+        )
+        if cancel_after is not None:
+            await asyncio.sleep(cancel_after)
+            main.GENERATIONS.cancel(session)
+        return await task
+
+    return asyncio.run(scenario())
+
+
+def diff_edit(handlers, message, last_code, output_type, session, cancel_after=None):
+    """Run a SEARCH/REPLACE follow-up through the chat handler; returns its outputs."""
+    history = [["Make a page", main.code_as_response(last_code, output_type)]]
+    return chat(
+        handlers,
+        message,
+        output_type,
+        session,
+        history=history,
+        last_code=last_code,
+        diff=True,
+        cancel_after=cancel_after,
+    )
+
+
+def test_diff_edit_patches_last_code(mock_ollama, handlers):
+    outputs = diff_edit(handlers, "Add a footer", PAGE, "HTML", "diff-edit")
+    _, history, _, last_code, _, _, _ = outputs[-1]
+    assert "<footer>Edited</footer>\n</body>" in last_code
+    assert history[-1][1] == main.code_as_response(last_code, "HTML")
+    (request,) = chat_requests(mock_ollama)
+    # The code is already in the last answer, so it isn't sent again
+    assert request["messages"][-1]["content"] == "Add a footer"
+
+
+def test_diff_edit_accepts_a_full_file_reply(mock_ollama, handlers):
+    page = PAGE.replace("Hello", "Goodbye")
+    mock_ollama.response = f"Here is the updated page:\n```html\n{page}\n```\n"
+    outputs = diff_edit(handlers, "Say goodbye", PAGE, "HTML", "diff-full")
+    assert outputs[-1][3] == page
+    assert len(chat_requests(mock_ollama)) == 1
+
+
+def test_cancel_during_diff_edit_does_not_regenerate(mock_ollama, handlers):
+    mock_ollama.tokens_per_second = 20
+    outputs = diff_edit(
+        handlers, "Add a footer", PAGE, "HTML", "diff-cancel", cancel_after=0.5
+    )
+    assert len(chat_requests(mock_ollama)) == 1
+    assert all(out[3] == PAGE for out in outputs)
+    assert main.GENERATIONS.active_counts() == (0, 0)
+
+
+def test_cancelled_generation_keeps_last_code_and_history(mock_ollama, handlers):
+    mock_ollama.tokens_per_second = 50
+    first_turn = ["Make a page", main.code_as_response(PAGE, "HTML")]
+    history = [first_turn]
+    outputs = chat(
+        handlers,
+        "Make it blue",
+        "HTML",
+        "full-cancel",
+        history=history,
+        last_code=PAGE,
+        cancel_after=0.5,
+    )
+    assert outputs and outputs[-1][2].startswith("<!DOCTYPE html>")
+    assert all(out[3] == main.gr.update() for out in outputs)
+    assert history == [first_turn]
+
+
+def test_cancelled_generation_raises_and_logs_output_tokens(mock_ollama, capsys):
+    mock_ollama.ttft = 1.0
+
+    async def scenario():
+        task = asyncio.ensure_future(
+            main.achat_with_model(
+                "Hi", [], MODEL, 0.7, SYSTEM_PROMPT, False, session="early"
+            )
+        )
+        await asyncio.sleep(0.3)
+        main.GENERATIONS.cancel("early")
+        with pytest.raises(main.GenerationCancelled):
+            await task
+
+    asyncio.run(scenario())
+    assert f"Cancelled {MODEL} generation after 0 tokens" in capsys.readouterr().out
+
+
+def test_transformers_js_patch_targets_named_file(mock_ollama, handlers):
+    files = {
+        "index.html": "<p>hello</p>",
+        "index.js": 'console.log("hello");',
+        "style.css": "p { color: red; }",
+    }
+    code = main.format_transformers_js_output(files)
+    patch = "<<<<<<< SEARCH\nhello\n=======\ngoodbye\n>>>>>>> REPLACE\n"
+
+    mock_ollama.response = "In index.js:\n" + patch
+    outputs = diff_edit(handlers, "Say goodbye", code, "Transformers.js", "tjs")
+    patched = main.parse_transformers_js_output(outputs[-1][3])
+    assert patched == dict(files, **{"index.js": 'console.log("goodbye");'})
+
+    # Without a file name the first file that matches is patched
+    unnamed = main.parse_transformers_js_output(
+        main.apply_search_replace(code, patch, "Transformers.js")
+    )
+    assert unnamed == dict(files, **{"index.html": "<p>goodbye</p>"})
+
+
+def test_warm_up_chat_and_compaction_share_num_ctx(mock_ollama):
+    main.ENGINE_LOOP.run(main.MODEL_WARMER._load(MODEL))
+    history = []
+    main.chat_with_model("Build a todo list", history, MODEL, 0.7, SYSTEM_PROMPT, False)
+    history.append(["Add a footer", history[-1][1]])
+    compaction = {}
+    main.ENGINE_LOOP.run(main._compact_history(history, compaction, MODEL))
+    assert compaction["covered"] == 1
+
+    generations = [
+        (path, body["options"]["num_ctx"])
+        for path, body in mock_ollama.requests
+        if path in ("/api/chat", "/api/generate")
+    ]
+    expected = main.ENGINE_LOOP.run(main.default_num_ctx(MODEL))
+    assert [path for path, _ in generations] == [
+        "/api/generate",
+        "/api/chat",
+        "/api/chat",
+    ]
+    assert {num_ctx for _, num_ctx in generations} == {expected}
+
+
+def test_project_response_is_parsed_into_files(mock_ollama):
+    response, _ = main.chat_with_model(
+        "Build a Flask app",
+        [],
+        MODEL,
+        0.7,
+        main.get_system_prompt(main.PROJECT_OUTPUT_TYPE, False),
+        False,
+        output_type=main.PROJECT_OUTPUT_TYPE,
+    )
+    files = main.parse_project_output(response)
+    assert list(files) == [
+        "app.py",
+        "templates/index.html",
+        "static/style.css",
+        "requirements.txt",
+    ]
+    assert files["requirements.txt"] == "flask"
+    assert not any(content.startswith("```") for content in files.values())
+
+
+def test_project_files_survive_rendering(mock_ollama, handlers, tmp_path, monkeypatch):
+    monkeypatch.setattr(main, "PROJECT_ZIP_DIR", str(tmp_path))
+    mock_ollama.response = (
+        "=== README.md ===\n```markdown\n```bash\npip install flask\n```\n"
+        "Then run app.py.\n```\n\n"
+        '=== app.py ===\n```python\nUSAGE = """\n```python\nrun()\n```\n"""\n```\n\n'
+        "=== requirements.txt ===\n```\nflask\n```\n"
+    )
+    expected = {
+        "README.md": "```bash\npip install flask\n```\nThen run app.py.",
+        "app.py": 'USAGE = """\n```python\nrun()\n```\n"""',
+        "requirements.txt": "flask",
+    }
+    outputs = chat(handlers, "Build a Flask app", main.PROJECT_OUTPUT_TYPE, "tree")
+    files = outputs[-1][6]
+    assert files == expected
+    assert outputs[-1][5]["choices"] == list(expected)
+
+    shown = handlers["show_project_file"]("README.md", files)
+    assert shown["value"] == expected["README.md"]
+    request = types.SimpleNamespace(session_hash="tree")
+    archive = handlers["download_project"](files, request)["value"]
+    with main.zipfile.ZipFile(archive) as zipped:
+        assert {name: zipped.read(name).decode() for name in zipped.namelist()} == (
+            expected
+        )
+
+
+def test_early_stop_records_estimated_stats(mock_ollama):
+    # Slow enough that the stop arrives before the model's own end
+    mock_ollama.tokens_per_second = 200
+    stats_before = len(main.GENERATION_STATS)
+    response, _ = main.chat_with_model(
+        "Classify sentiment",
+        [],
+        MODEL,
+        0.7,
+        main.get_system_prompt("Transformers.js", False),
+        False,
+        output_type="Transformers.js",
+    )
+    # Recorded on the engine loop once the closed stream is cancelled
+    for _ in range(50):
+        if len(main.GENERATION_STATS) > stats_before:
+            break
+        time.sleep(0.02)
+    (stats,) = list(main.GENERATION_STATS)[stats_before:]
+    assert stats["estimated"] and stats["model"] == MODEL
+    assert stats["eval_count"] == main.TOKEN_ESTIMATOR.output_tokens(MODEL, response)
+    assert stats["prompt_eval_count"] > 0
+    assert f'ollama_coder_early_stops_total{{model="{MODEL}"}}' in main.METRICS.render()
+
+
+def test_identical_concurrent_requests_share_one_generation(mock_ollama):
+    mock_ollama.tokens_per_second = 200
+
+    async def scenario():
+        return await asyncio.gather(
+            *(
+                main.achat_with_model(
+                    "Build a todo list", [], MODEL, 0.7, SYSTEM_PROMPT, False
+                )
+                for _ in range(2)
+            )
+        )
+
+    (first, _), (second, _) = asyncio.run(scenario())
+    assert first.startswith("```html") and first == second
+    assert len(chat_requests(mock_ollama)) == 1
+
+
+def test_deterministic_requests_are_served_from_cache(mock_ollama, monkeypatch):
+    cache = main.ResponseCache(None, 1 << 20, 0)
+    monkeypatch.setattr(main, "RESPONSE_CACHE", cache)
+    first, _ = main.chat_with_model(
+        "Build a todo list", [], MODEL, 0, SYSTEM_PROMPT, False
+    )
+    second, _ = main.chat_with_model(
+        "Build a todo list", [], MODEL, 0, SYSTEM_PROMPT, False
+    )
+    assert first.startswith("```html") and first == second
+    assert len(chat_requests(mock_ollama)) == 1
+    assert cache.stats["memory_hits"] == 1
+
+
+def test_admission_serves_waiters_by_priority():
+    admission = main.AdmissionController(1, 4, 5)
+    order = []
+
+    async def request(name, priority):
+        async for _ in admission.wait_for_slot(MODEL, priority):
+            pass
+        order.append(name)
+        await asyncio.sleep(0.01)
+        admission.release(MODEL)
+
+    async def scenario():
+        await asyncio.gather(
+            request("first", 0), request("batch", 10), request("interactive", 0)
+        )
+
+    asyncio.run(scenario())
+    assert order == ["first", "interactive", "batch"]
+    assert admission.active(MODEL) == 0
+
+
+def test_admission_rejects_when_queue_is_full():
+    admission = main.AdmissionController(1, 1, 5)
+
+    async def scenario():
+        async for _ in admission.wait_for_slot(MODEL):
+            pass
+        waiter = asyncio.ensure_future(collect(admission.wait_for_slot(MODEL)))
+        await asyncio.sleep(0)
+        with pytest.raises(main.AdmissionError):
+            await collect(admission.wait_for_slot(MODEL))
+        admission.release(MODEL)
+        assert await waiter == [1]
+
+    asyncio.run(scenario())
+
+
+def test_batch_skips_malformed_lines(tmp_path, capsys):
+    path = tmp_path / "prompts.jsonl"
+    path.write_text(
+        '{"id": "a", "prompt": "Make a page"}\n'
+        '{"id": "b", "prompt": \n'
+        '["not", "an", "object"]\n'
+        '{"id": "c"}\n'
+        '{"id": "d", "prompt": "Make a form", "model": "llama3.2:3b"}\n',
+        encoding="utf-8",
+    )
+    items = main.load_batch_items(str(path))
+    assert [item["id"] for item in items] == ["a", "d"]
+    out = capsys.readouterr().out
+    assert "Skipping line 2: invalid JSON" in out
+    assert "Skipping line 3: not a JSON object" in out
+
+
+def test_batch_run_resumes_from_checkpoint(mock_ollama, tmp_path):
+    items = [
+        {
+            "id": i,
+            "prompt": p,
+            "output_type": "HTML",
+            "model": MODEL,
+            "temperature": 0.7,
+        }
+        for i, p in (("a", "Make a page"), ("b", "Make a form"))
+    ]
+    checkpoint = str(tmp_path / "state" / "checkpoint.jsonl")
+    output_dir = str(tmp_path / "out")
+
+    summary = asyncio.run(main.run_batch(items, output_dir, checkpoint, 2))
+    assert (summary["done"], summary["failed"], summary["skipped"]) == (2, 0, 0)
+    assert main.read_checkpoint(checkpoint) == {"a", "b"}
+    assert len(chat_requests(mock_ollama)) == 2
+
+    summary = asyncio.run(main.run_batch(items, output_dir, checkpoint, 2))
+    assert (summary["done"], summary["skipped"]) == (0, 2)
+    assert len(chat_requests(mock_ollama)) == 2
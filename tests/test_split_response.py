@@ -0,0 +1,102 @@
+import main
+
+SETEXT_README = (
+    "=== README.md ===\n"
+    "```markdown\n"
+    "Title\n"
+    "=====\n"
+    "\n"
+    "Some text.\n"
+    "```\n"
+    "\n"
+    "=== app.py ===\n"
+    "```python\n"
+    "print(1)\n"
+    "```\n"
+)
+
+NESTED_README = (
+    "=== README.md ===\n"
+    "```markdown\n"
+    "# App\n"
+    "\n"
+    "Install:\n"
+    "\n"
+    "```bash\n"
+    "pip install flask\n"
+    "```\n"
+    "\n"
+    "Then run it.\n"
+    "```\n"
+    "\n"
+    "=== app.py ===\n"
+    "```python\n"
+    "print(1)\n"
+    "```\n"
+)
+
+
+def test_setext_underline_inside_block_is_not_a_section():
+    blocks, sections = main.split_response(SETEXT_README)
+    assert blocks[0] == ("markdown", "Title\n=====\n\nSome text.")
+    assert list(sections) == ["README.md", "app.py"]
+
+
+def test_nested_fence_stays_inside_block():
+    blocks, _ = main.split_response(NESTED_README)
+    assert blocks == [
+        (
+            "markdown",
+            "# App\n\nInstall:\n\n```bash\npip install flask\n```\n\nThen run it.",
+        ),
+        ("python", "print(1)"),
+    ]
+
+
+def test_project_markdown_files():
+    files = main.parse_project_output(SETEXT_README)
+    assert files == {"README.md": "Title\n=====\n\nSome text.", "app.py": "print(1)"}
+    files = main.parse_project_output(NESTED_README)
+    assert files["README.md"].endswith(
+        "```bash\npip install flask\n```\n\nThen run it."
+    )
+    assert files["app.py"] == "print(1)"
+
+
+def test_missing_closing_fence_starts_next_block():
+    text = "```html\n<p>x</p>\n```javascript\nlet a;\n```\n\n```css\nb {}\n```\n"
+    assert main.parse_transformers_js_output(text) == {
+        "index.html": "<p>x</p>",
+        "index.js": "let a;",
+        "style.css": "b {}",
+    }
+
+
+def test_only_full_header_lines_start_sections():
+    text = "=== index.js ===\nconst a = 1;\n=== not a header\nconst b = 2;\n"
+    _, sections = main.split_response(text)
+    assert sections == {"index.js": "const a = 1;\n=== not a header\nconst b = 2;"}
+
+
+def test_remove_code_block_prefers_html():
+    text = "Intro\n```css\nb {}\n```\n```html\n<p>x</p>\n```\nBye"
+    assert main.remove_code_block(text) == "<p>x</p>"
+
+
+def test_streamed_project_matches_final_parse():
+    for text in (SETEXT_README, NESTED_README):
+        extractor = main.CodeStreamExtractor(main.PROJECT_OUTPUT_TYPE)
+        for i in range(0, len(text), 7):
+            extractor.feed(text[i : i + 7])
+        assert extractor.files() == main.parse_project_output(text)
+
+
+def test_project_zip_is_reused_per_session(tmp_path, monkeypatch):
+    monkeypatch.setattr(main, "PROJECT_ZIP_DIR", str(tmp_path))
+    first = main.write_project_zip({"a.py": "x = 1"}, "session")
+    second = main.write_project_zip({"a.py": "x = 2", "../b.py": "no"}, "session")
+    assert first == second
+    with main.zipfile.ZipFile(second) as archive:
+        assert archive.namelist() == ["a.py"]
+    main.remove_project_zip("session")
+    assert list(tmp_path.iterdir()) == []